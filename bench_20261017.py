@@ -0,0 +1,266 @@
+############################################################
+############################################################
+#############   bench.py   ##########################
+##############################################################
+############################################################
+#
+# Benchmark module v20261017
+#
+# Times sim.multi_poissonN, cumulant.cumulants (with and without
+# the jackknife), cumulant.kcov, cumulant.kcovint, gmm.gmm (each
+# weight) and gmm.gmmG against sample size N and number of steps,
+# on data simulated with fixed seeds.  The peak memory allocated
+# by each case is measured with tracemalloc.  Results are saved as
+# a JSON baseline, and a later run can be compared with it to flag
+# cases that have become slower.
+#
+# example:
+# python bench.py --save baseline.json
+# python bench.py --compare baseline.json --threshold 1.25
+#
+# or from python:
+# results = bench.run()
+# bench.save(results,'baseline.json')
+# bench.compare(results,bench.load('baseline.json'))
+#
+############################################################
+############################################################
+
+from __future__ import print_function
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import sim
+import cumulant as cu
+import gmm
+try:
+    import tracemalloc
+except ImportError:	# python 2, memory is not measured
+    tracemalloc = None
+
+SIZES = [10,100,1000,10000]	# default sample sizes N
+STEPS = [1,2,3]			# default numbers of steps
+WEIGHTS = ['jack','iden','analytic','int','mc']
+clock = getattr(time,'perf_counter',time.time)
+
+##############################################################
+#############   cases()   ##########################
+##############################################################
+#
+# the benchmark cases for one sample size and number of steps.  The
+# sample is simulated with a seed fixed by N and steps, so every run
+# times the same work.
+#
+# input:
+# N		sample size
+# steps		number of steps
+# table		cumulant.CovarianceTable for kcovint and weight='int',
+#		cases needing it are left out if None
+#
+# output:
+# list of (name, function of no arguments)
+#
+def cases(N,steps,table=None):
+
+    tau = 10.0*3.0**np.arange(steps)
+    tau0 = 1.2*tau
+    sample = sim.multi_poissonN(tau,N,seed=[N,steps])
+    taulist = [list(t) for t in 10.0**np.indices([3]*steps).reshape(steps,-1).T]
+    order = max(steps,2)
+    twostep = steps == 2 and table is not None
+
+    def mc():
+        cu.KcovCache.clear()	# time the simulation, not the cache
+        return gmm.gmm(sample,tau0,n=order,weight='mc')
+
+    found = [ ('sim.multi_poissonN', lambda: sim.multi_poissonN(tau,N,seed=0)),
+              ('cumulant.cumulants', lambda: cu.cumulants(sample,n=4)),
+              ('cumulant.cumulants jack', lambda: cu.cumulants(sample,n=4,jack=True)),
+              ('cumulant.kcov', lambda: cu.kcov(tau,N,seed=0,cache=False)) ]
+    if twostep:
+        found.append(('cumulant.kcovint', lambda: cu.kcovint(tau,N,table=table)))
+    for weight in WEIGHTS:
+        if weight == 'int' and not twostep:
+            continue
+        if weight == 'mc':
+            found.append(('gmm.gmm mc',mc))
+        else:
+            found.append(('gmm.gmm '+weight, lambda weight=weight: gmm.gmm(sample,tau0,n=order,weight=weight,table=table)))
+    found.append(('gmm.gmmG', lambda: gmm.gmmG(sample,taulist,n=order)))
+
+    return found
+
+##############################################################
+#############   measure()   ##########################
+##############################################################
+#
+# time a function, as the best of repeat rounds of enough calls to
+# take at least mintime seconds, and find the peak memory it
+# allocates in one more call
+#
+# output:
+# seconds	time per call
+# memory	peak bytes allocated during a call (None on python 2)
+#
+def measure(call,repeat=5,mintime=0.1):
+
+    call()	# warm up
+    number = 1
+    while True:
+        start = clock()
+        for i in range(number):
+            call()
+        elapsed = clock() - start
+        if elapsed >= mintime or number >= 2**20:
+            break
+        number = number*2
+    best = elapsed
+    for r in range(repeat-1):
+        start = clock()
+        for i in range(number):
+            call()
+        best = min(best,clock() - start)
+
+    memory = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        call()
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return best/number, memory
+
+##############################################################
+#############   run()   #####################################
+##############################################################
+#
+def run(sizes=SIZES,steps=STEPS,table=None,repeat=5,mintime=0.1,select=None,verbose=True):
+    """run the benchmark suite.
+
+    input:
+    sizes       list of sample sizes N
+    steps       list of numbers of steps
+    table       cumulant.CovarianceTable (or file name) for kcovint
+                and weight='int', default cumulant.DefaultTable.
+                These cases are left out if there is no table
+    repeat      rounds of timing of each case, the best is kept
+    mintime     least time of a round in seconds
+    select      if given, only cases whose name contains this
+    verbose     print each result
+    output:
+    results     dictionary {case: {'name','N','steps','seconds','memory'}}
+                where case is e.g. 'gmm.gmm jack N=100 steps=2'"""
+
+    if table is None:
+        table = cu.DefaultTable
+    elif not isinstance(table,cu.CovarianceTable):
+        table = cu.CovarianceTable(table)
+
+    results = {}
+    for s in steps:
+        for N in sizes:
+            for name, call in cases(N,s,table):
+                if select is not None and select not in name:
+                    continue
+                seconds, memory = measure(call,repeat,mintime)
+                case = '%s N=%d steps=%d' % (name,N,s)
+                results[case] = {'name':name,'N':N,'steps':s,'seconds':seconds,'memory':memory}
+                if verbose == True:
+                    print('%-40s %12.6f s %12s bytes' % (case,seconds,memory))
+
+    return results
+
+##############################################################
+#############   save(), load()   ##########################
+##############################################################
+#
+# save results with a description of the machine, or load them
+#
+def save(results,filename):
+
+    baseline = {'python':platform.python_version(),'numpy':np.__version__,
+                'machine':platform.platform(),'time':time.strftime('%Y-%m-%d %H:%M:%S'),
+                'results':results}
+    with open(filename,'w') as outfile:
+        json.dump(baseline,outfile,indent=1,sort_keys=True)
+
+def load(filename):
+
+    with open(filename) as infile:
+        return json.load(infile)['results']
+
+##############################################################
+#############   compare()   ##########################
+##############################################################
+#
+# compare results with a baseline.  A case is a regression if its
+# time (or peak memory) is more than threshold times the baseline.
+#
+# input:
+# results	as returned by run()
+# baseline	as returned by load()
+# threshold	allowed ratio to the baseline (default 1.25)
+# verbose	print the ratio of every case
+#
+# output:
+# regressions	list of (case, quantity, ratio)
+#
+def compare(results,baseline,threshold=1.25,verbose=True):
+
+    regressions = []
+    for case in sorted(results):
+        if case not in baseline:
+            continue
+        line = '%-40s' % case
+        for quantity in ['seconds','memory']:
+            new, old = results[case][quantity], baseline[case][quantity]
+            if new is None or old is None or old == 0:
+                line = line + '%14s' % '-'
+                continue
+            ratio = float(new)/old
+            flag = ''
+            if ratio > threshold:
+                regressions.append((case,quantity,ratio))
+                flag = ' !'
+            line = line + '%12.2fx%s' % (ratio,flag.ljust(2))
+        if verbose == True:
+            print(line)
+    if verbose == True:
+        print(len(regressions),"regressions of",len(results),"cases (threshold %gx)" % threshold)
+
+    return regressions
+
+##############################################################
+#############   main()   #####################################
+##############################################################
+#
+def main(argv=None):
+    """command line entry point, see python bench.py --help"""
+
+    parser = argparse.ArgumentParser(description="benchmark the gmm, cumulant and sim modules")
+    parser.add_argument('--sizes',type=int,nargs='+',default=SIZES,help="sample sizes N")
+    parser.add_argument('--steps',type=int,nargs='+',default=STEPS,help="numbers of steps")
+    parser.add_argument('--table',default='grandmatrix.pkl',help="covariance table for kcovint (left out if missing)")
+    parser.add_argument('--repeat',type=int,default=5,help="timing rounds of each case")
+    parser.add_argument('--select',default=None,help="only cases whose name contains this")
+    parser.add_argument('--save',default=None,help="save results as a JSON baseline")
+    parser.add_argument('--compare',default=None,help="JSON baseline to compare with")
+    parser.add_argument('--threshold',type=float,default=1.25,help="ratio to baseline flagged as a regression")
+    args = parser.parse_args(argv)
+
+    table = args.table if os.path.exists(args.table) else None
+    results = run(args.sizes,args.steps,table=table,repeat=args.repeat,select=args.select)
+    if args.save is not None:
+        save(results,args.save)
+    if args.compare is not None:
+        if len(compare(results,load(args.compare),args.threshold)) > 0:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
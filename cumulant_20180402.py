@@ -13,48 +13,222 @@
 ############################################################
 ############################################################
 
+from __future__ import print_function
 import numpy as np
+import collections
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
 import sim
-import cPickle as pickle
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 ############################################################
 ############# define global variable
 ##################################################
 
-GrandMatrix = np.zeros([1,1,1])
-NumSamples = [1]
-TauTwo = [1.0]
+# covariance table used by kcovint() when none is given, set by initialize()
+DefaultTable = None
+
+# cache of monte-carlo covariance matrices used by kcov(), oldest first
+KcovCache = collections.OrderedDict()
+KcovCacheSize = 256
+
+##############################################################
+############## covariance table directories
+###############################################################
+#
+# a covariance table (grand matrix) is kept in a directory holding
+#   manifest.json	format version and how the table was made
+#   NumSamples.npy	sample sizes N, increasing
+#   TauTwo.npy		ratios tau2/tau1, increasing
+#   GrandMatrix.npy	array [N,ratio,4,4], covariance of the first
+#			four cumulants for tau = [1, ratio].  Points
+#			not yet computed are nan
+# see the table module for building one.
+#
+TableVersion = 1
+
+def readtable(path,mmap_mode=None):
+    """read a covariance table directory into a dictionary, arrays
+    are memory mapped if mmap_mode is given (e.g. 'r')"""
+
+    with open(os.path.join(path,'manifest.json')) as infile:
+        table = json.load(infile)
+    if table['version'] > TableVersion:
+        raise ValueError("table %s has version %d, newer than this code (%d)" % (path,table['version'],TableVersion))
+    for name in ['NumSamples','TauTwo','GrandMatrix']:
+        table[name] = np.load(os.path.join(path,name+'.npy'),mmap_mode=mmap_mode)
+
+    return table
+
+##############################################################
+#############   mapcopy()   ##########################
+##############################################################
+#
+# table directory converted from a pickled table, so that it can be
+# memory mapped.  The copy is kept beside the pickle file (e.g.
+# grandmatrix.pkl.table) with the size and modification time of
+# the pickle file in its manifest, and is made again if these
+# change.  It is written in a temporary directory and renamed, so
+# processes converting at the same time do not see it half made.
+#
+# input:
+# filename	pickle file
+# arrays	[NumSamples, TauTwo, GrandMatrix] read from it
+#
+# output:
+# path		table directory, or None if it can not be written
+#		(e.g. a read only directory)
+#
+def mapcopy(filename,arrays=None):
+
+    path = filename + '.table'
+    status = os.stat(filename)
+    source = [int(status.st_size),int(status.st_mtime_ns)]
+    try:
+        with open(os.path.join(path,'manifest.json')) as infile:
+            if json.load(infile).get('source') == source:
+                return path
+    except (OSError,ValueError):
+        pass
+    if arrays is None:
+        return None
+
+    try:
+        temporary = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)),prefix=os.path.basename(path)+'.')
+    except OSError:
+        return None
+    try:
+        GrandMatrix = np.array(arrays[2],dtype=float)
+        for name, array in zip(['NumSamples','TauTwo','GrandMatrix'],[arrays[0],arrays[1],GrandMatrix]):
+            np.save(os.path.join(temporary,name+'.npy'),array)
+        manifest = {'version':TableVersion,'trials':None,'seed':None,'shape':list(GrandMatrix.shape),
+                    'missing':int(np.isnan(GrandMatrix[:,:,0,0]).sum()),'source':source}
+        with open(os.path.join(temporary,'manifest.json'),'w') as outfile:
+            json.dump(manifest,outfile,indent=1)
+        os.chmod(temporary,0o755)
+        if os.path.isdir(path):		# an old copy
+            shutil.rmtree(path,ignore_errors=True)
+        os.rename(temporary,path)
+    except OSError:
+        shutil.rmtree(temporary,ignore_errors=True)
+        return mapcopy(filename)	# the path if another process made it
+
+    return path
+
+##############################################################
+#############   CovarianceTable   ##########################
+##############################################################
+#
+# covariance table (grand matrix) used by kcovint().  Nothing is
+# read until the table is first used.  A table directory is 
+# memory mapped read-only, so processes using the same table share
+# its pages.  A pickled table (the original grandmatrix.pkl) is 
+# converted to a directory beside it the first time it is used 
+# (see mapcopy()) and mapped from then on, or read into memory if
+# the copy can not be written.  When a CovarianceTable is sent to a worker 
+# process only its file name is pickled, and the worker maps the
+# file itself.
+#
+# input:
+# filename	table directory (see readtable()) or pickle file
+#
+# use:
+# table = CovarianceTable("grandmatrix.table")
+# kcovint(tau,N,table=table)
+# table.NumSamples, table.TauTwo, table.GrandMatrix
+#
+class CovarianceTable(object):
+
+    def __init__(self,filename="grandmatrix.pkl"):
+
+        self.filename = filename
+        self.arrays = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """read (or map) the table, if not done yet"""
+
+        with self.lock:
+            if self.arrays is not None:
+                return self.arrays
+            path = self.filename
+            if not os.path.isdir(path):
+                path = mapcopy(self.filename)
+            if path is not None:
+                junk = readtable(path,mmap_mode='r')
+                junk = [junk['NumSamples'], junk['TauTwo'], junk['GrandMatrix']]
+            else:
+                infile = open( self.filename, "rb" )
+                try:
+                    junk = pickle.load( infile, encoding="latin1" )  # python 3, table was pickled by python 2
+                except TypeError:
+                    junk = pickle.load( infile )
+                infile.close()
+                path = mapcopy(self.filename,junk)
+                if path is not None:
+                    junk = readtable(path,mmap_mode='r')
+                    junk = [junk['NumSamples'], junk['TauTwo'], junk['GrandMatrix']]
+            self.arrays = [np.array(junk[0],dtype=float), np.array(junk[1],dtype=float), junk[2]]
+
+        return self.arrays
+
+    @property
+    def NumSamples(self):
+        return self.load()[0]
+
+    @property
+    def TauTwo(self):
+        return self.load()[1]
+
+    @property
+    def GrandMatrix(self):
+        return self.load()[2]
+
+    def __getstate__(self):
+        return {'filename':self.filename}
+
+    def __setstate__(self,state):
+        self.__init__(state['filename'])
 
 ##############################################################3
 ############## read in the grand matrix
 ###############################################################
 #
 def initialize(filename="grandmatrix.pkl"):
-    """initialize the grand matrix"""
+    """set the covariance table used by kcovint() when none is given.
+    filename is the original pickle file or a table directory written
+    by the table module.  The table is read when first used"""
 
-    global GrandMatrix
-    global NumSamples
-    global TauTwo
+    global DefaultTable
 
-    junk = pickle.load( open( filename, "rb" ) )
-
-    NumSamples = junk[0]
-    TauTwo = junk[1]
-    GrandMatrix = junk[2]
+    DefaultTable = CovarianceTable(filename)
 
     return True
 
 
-def printGrandMatrix(index=0):
+def printGrandMatrix(index=0,table=None):
+
+    if table is None:
+        table = DefaultTable
+    NumSamples = table.NumSamples
+    TauTwo = table.TauTwo
+    GrandMatrix = table.GrandMatrix
 
-    print "NumSamples =", NumSamples
-    print "TauTwo = ", TauTwo
-    print "size of grand matrix = ", len(GrandMatrix), "X", len(GrandMatrix[0]), "X", len(GrandMatrix[0,0]), "X", len(GrandMatrix[0,0,0])
+    print("NumSamples =", NumSamples)
+    print("TauTwo = ", TauTwo)
+    print("size of grand matrix = ", len(GrandMatrix), "X", len(GrandMatrix[0]), "X", len(GrandMatrix[0,0]), "X", len(GrandMatrix[0,0,0]))
 
     if index != 0:
-        print "covariance ", index[0], index[1]
-        print "N, tauB =", NumSamples[index[0]], TauTwo[index[1]]
-        print GrandMatrix[index[0],index[1]]
+        print("covariance ", index[0], index[1])
+        print("N, tauB =", NumSamples[index[0]], TauTwo[index[1]])
+        print(GrandMatrix[index[0],index[1]])
 
     return True
 
@@ -83,6 +257,134 @@ def stats(junk):
 
     return average, meandev, standard, stderr
 
+##############################################################
+#############   segments()   ##########################
+##############################################################
+#
+# put a batch of samples into the form used by the batched
+# functions: one flat buffer holding every sample end to end,
+# and a vector with the length of each sample
+#
+# input:
+# samples	2D array [trials,N] of wait times (one sample per row),
+#		a list of 1D samples (may have different lengths), or
+#		a flat buffer of samples placed end to end if lengths
+#		is supplied
+# lengths	length of each sample in a flat buffer (default None)
+#
+# output:
+# x, lengths	flat float array, integer array of sample lengths
+#
+def segments(samples,lengths=None):
+
+    if lengths is not None:
+        x = np.asarray(samples,dtype=float).reshape(-1)	# no copy of a mapped buffer
+        lengths = np.array(lengths,dtype=int).reshape(-1)
+        if lengths.sum() != len(x):
+            raise ValueError("lengths do not add up to size of sample buffer")
+    elif isinstance(samples,np.ndarray) and samples.ndim == 2:
+        x = np.array(samples,dtype=float).reshape(-1)
+        lengths = np.full(samples.shape[0],samples.shape[1],dtype=int)
+    else:
+        samples = [np.array(sample,dtype=float).reshape(-1) for sample in samples]
+        x = np.concatenate(samples)
+        lengths = np.array([len(sample) for sample in samples],dtype=int)
+
+    if np.any(lengths < 1):
+        raise ValueError("every sample must contain at least one wait time")
+
+    return x, lengths
+
+##############################################################
+#############   jackknife_moments()   ##########################
+##############################################################
+#
+# calculate the leave-one-out mean and central moments of a
+# sample for every observation at once.  The power sums of the
+# full sample (about its mean) are computed once, the sums with
+# observation i removed follow by subtraction, and these are
+# shifted to the leave-one-out mean with the binomial expansion.
+# This replaces N calls to np.delete with a single O(N) pass.
+#
+# input:
+# sample	array or list of wait times
+# lengths	if supplied, sample is a flat buffer of several samples
+#		placed end to end (see segments()), and each observation
+#		is left out of its own sample only (default None)
+#
+# output:
+# rm1, cm2, cm3, cm4, cm5, cm6
+#		arrays of length N, element i is the mean or central
+#		moment of the sample with observation i removed
+#
+def jackknife_moments(sample,lengths=None):
+
+    x = np.asarray(sample,dtype=float).reshape(-1)
+    if lengths is None:
+        lengths = [len(x)]
+    lengths = np.array(lengths,dtype=int)
+    starts = np.cumsum(lengths) - lengths
+    N = np.repeat(lengths.astype(float),lengths)	# size of the sample holding each observation
+    mean = np.repeat(np.add.reduceat(x,starts)/lengths,lengths)
+    y = x - mean	# deviations from full sample mean
+    d = -y/(N-1.0)	# leave-one-out mean, relative to full sample mean
+
+    # power sums of deviations with observation i removed, S[0] = N-1
+    power = np.ones(len(x))
+    S = []
+    for p in range(7):
+        S.append(np.repeat(np.add.reduceat(power,starts),lengths) - power)
+        power = power*y
+
+    # powers of the shift, D[q] = (-d)^q
+    D = [np.ones(len(x))]
+    for q in range(6):
+        D.append(-d*D[q])
+
+    # central moments about the leave-one-out mean
+    #   sum_j (y_j-d)^p = sum_q C(p,q) (-d)^(p-q) S[q]
+    moments = []
+    binomial = [1.0]
+    for p in range(1,7):
+        binomial = [1.0] + [binomial[q-1]+binomial[q] for q in range(1,p)] + [1.0]
+        total = S[p].copy()
+        for q in range(p):
+            total += binomial[q]*S[q]*D[p-q]
+        moments.append(total/(N-1.0))
+
+    return mean+d, moments[1], moments[2], moments[3], moments[4], moments[5]
+
+##############################################################
+#############   moments_to_cumulants()   ##########################
+##############################################################
+#
+# convert means and central moments to cumulants, using the same
+# formulas as cumulants().  Works elementwise on arrays.
+#
+# input:
+# rm1, cm2, cm3, cm4, cm5, cm6	mean and central moments
+# N		sample size(s) used in bias correction
+# bc		apply bias correction? (default True)
+#
+# output:
+# [k1, k2, k3, k4, k5, k6]
+#
+def moments_to_cumulants(rm1,cm2,cm3,cm4,cm5,cm6,N,bc=True):
+
+    N = np.array(N,dtype=float)
+    if bc==True:
+        k2 = cm2*N/(N-1.0)
+        k3 = cm3*N*N/(N-1.0)/(N-2.0)
+        k4 = ( cm4*(N+1.0) - 3.0*cm2*cm2*(N-1.0) )*N*N/(N-1.0)/(N-2.0)/(N-3.0)
+    else:
+        k2 = cm2
+        k3 = cm3
+        k4 = cm4 - 3.0*cm2*cm2
+    k5 = cm5 - 10.0*cm3*cm2
+    k6 = cm6 - 15.0*cm4*cm2 - 10.0*cm3*cm3 + 30.0*cm2*cm2*cm2
+
+    return [rm1,k2,k3,k4,k5,k6]
+
 ##############################################################
 #############   cumulants()   ##########################
 ##############################################################
@@ -126,30 +428,15 @@ def cumulants(sample,n=4,jack=False,bc=True):
         k[4] = cm5 - 10.0*cm3*cm2       
         k[5] = cm6 - 15.0*cm4*cm2 - 10.0*cm3*cm3 + 30.0*cm2*cm2*cm2    
         if jack==True:
-            # initialize the jackknife cumulants
-            jackknife_k1 = np.zeros(N)
-            jackknife_k2 = np.zeros(N)
-            jackknife_k3 = np.zeros(N)
-            jackknife_k4 = np.zeros(N)
-            jackknife_k5 = np.zeros(N)
-            jackknife_k6 = np.zeros(N)
-
-            # calculate the jackknife sample cumulants out to order 6
-            for i in range(N):
-                jackknife_sample = np.delete(sample,i)
-                rm1 = np.mean(jackknife_sample)  
-                deviation = jackknife_sample - rm1
-                cm2 = np.mean(deviation*deviation)
-                cm3 = np.mean(deviation*deviation*deviation)
-                cm4 = np.mean(deviation*deviation*deviation*deviation)
-                cm5 = np.mean(deviation*deviation*deviation*deviation*deviation)
-                cm6 = np.mean(deviation*deviation*deviation*deviation*deviation*deviation)
-                jackknife_k1[i] = rm1
-                jackknife_k2[i] = cm2*N/(N-1.0)
-                jackknife_k3[i] = cm3*N*N/(N-1.0)/(N-2.0)
-                jackknife_k4[i] = ( cm4*(N+1.0) - 3.0*cm2*cm2*(N-1.0) )*N*N/(N-1.0)/(N-2.0)/(N-3.0)
-                jackknife_k5[i] = cm5 - 10.0*cm3*cm2      
-                jackknife_k6[i] = cm6 - 15.0*cm4*cm2 - 10.0*cm3*cm3 + 30.0*cm2*cm2*cm2    
+            # calculate the jackknife sample cumulants out to order 6,
+            # all leave-one-out moments are found in a single pass
+            rm1, cm2, cm3, cm4, cm5, cm6 = jackknife_moments(sample)
+            jackknife_k1 = rm1
+            jackknife_k2 = cm2*N/(N-1.0)
+            jackknife_k3 = cm3*N*N/(N-1.0)/(N-2.0)
+            jackknife_k4 = ( cm4*(N+1.0) - 3.0*cm2*cm2*(N-1.0) )*N*N/(N-1.0)/(N-2.0)/(N-3.0)
+            jackknife_k5 = cm5 - 10.0*cm3*cm2
+            jackknife_k6 = cm6 - 15.0*cm4*cm2 - 10.0*cm3*cm3 + 30.0*cm2*cm2*cm2
 
             # calculate the jackknife estimate of the covariance matrix
             kcov = np.cov([jackknife_k1,jackknife_k2,jackknife_k3,jackknife_k4,jackknife_k5,jackknife_k6],bias=True)[n][:,n]
@@ -165,30 +452,15 @@ def cumulants(sample,n=4,jack=False,bc=True):
         k[5] = cm6 - 15.0*cm4*cm2 - 10.0*cm3*cm3 + 30.0*cm2*cm2*cm2
 
         if jack==True:
-            # initialize the jackknife cumulants
-            jackknife_k1 = np.zeros(N)
-            jackknife_k2 = np.zeros(N)
-            jackknife_k3 = np.zeros(N)
-            jackknife_k4 = np.zeros(N)
-            jackknife_k5 = np.zeros(N)
-            jackknife_k6 = np.zeros(N)
-
-            # calculate the jackknife sample cumulants out to order 6
-            for i in range(N):
-                jackknife_sample = np.delete(sample,i)
-                rm1 = np.mean(jackknife_sample)  
-                deviation = jackknife_sample - rm1
-                cm2 = np.mean(deviation*deviation)
-                cm3 = np.mean(deviation*deviation*deviation)
-                cm4 = np.mean(deviation*deviation*deviation*deviation)
-                cm5 = np.mean(deviation*deviation*deviation*deviation*deviation)
-                cm6 = np.mean(deviation*deviation*deviation*deviation*deviation*deviation)
-                jackknife_k1[i] = rm1
-                jackknife_k2[i] = cm2
-                jackknife_k3[i] = cm3
-                jackknife_k4[i] = cm4 - 3.0*cm2*cm2
-                jackknife_k5[i] = cm5 - 10.0*cm3*cm2      
-                jackknife_k6[i] = cm6 - 15.0*cm4*cm2 - 10.0*cm3*cm3 + 30.0*cm2*cm2*cm2    
+            # calculate the jackknife sample cumulants out to order 6,
+            # all leave-one-out moments are found in a single pass
+            rm1, cm2, cm3, cm4, cm5, cm6 = jackknife_moments(sample)
+            jackknife_k1 = rm1
+            jackknife_k2 = cm2
+            jackknife_k3 = cm3
+            jackknife_k4 = cm4 - 3.0*cm2*cm2
+            jackknife_k5 = cm5 - 10.0*cm3*cm2
+            jackknife_k6 = cm6 - 15.0*cm4*cm2 - 10.0*cm3*cm3 + 30.0*cm2*cm2*cm2
 
             # calculate the jackknife estimate of the covariance matrix
             kcov = np.cov([jackknife_k1,jackknife_k2,jackknife_k3,jackknife_k4,jackknife_k5,jackknife_k6],bias=True)[n][:,n]
@@ -198,6 +470,328 @@ def cumulants(sample,n=4,jack=False,bc=True):
  
     return k
 
+##############################################################
+#############   cumulantsN()   ##########################
+##############################################################
+#
+# calculate the cumulants of many samples at once.  Same as 
+# calling cumulants() on every sample, but done in a single
+# vectorized pass over all of the data.
+#
+# input:
+# samples	2D array [trials,N] of wait times (one sample per row),
+#		a list of 1D samples (may have different lengths), or
+#		a flat buffer of samples placed end to end
+# n		number of orders, up to 6 (default=4)
+# jack		determine jackknife estimate of uncertaity? (default:False)
+# bc		apply bias correction? (default True)
+# lengths	length of each sample if samples is a flat buffer
+#
+# output:
+# k		if jack=False
+# k, kcov	if jack=True
+#
+# k[m] = cumulants of sample m, array [trials,order]
+# kcov[m] = covariance of cumulants of sample m, array [trials,order,order]
+#
+def cumulantsN(samples,n=4,jack=False,bc=True,lengths=None):
+
+#   process arguments
+    if type(n) == int:
+        n = np.concatenate( [np.ones(n),np.zeros(6-n)] )
+    n = np.array([bool(n[0]),bool(n[1]),bool(n[2]),bool(n[3]),bool(n[4]),bool(n[5])])
+    x, lengths = segments(samples,lengths)
+    starts = np.cumsum(lengths) - lengths
+    N = lengths.astype(float)
+
+#   calculate cumulants
+    rm1 = np.add.reduceat(x,starts)/N
+    deviation = x - np.repeat(rm1,lengths)
+    power = deviation*deviation
+    cm = [rm1]
+    for p in range(2,7):
+        cm.append(np.add.reduceat(power,starts)/N)
+        power = power*deviation
+    k = np.array(moments_to_cumulants(cm[0],cm[1],cm[2],cm[3],cm[4],cm[5],N,bc=bc))[n].T
+
+    if jack==True:
+        # jackknife cumulants of every observation in every sample
+        rm1, cm2, cm3, cm4, cm5, cm6 = jackknife_moments(x,lengths)
+        jackknife_k = moments_to_cumulants(rm1,cm2,cm3,cm4,cm5,cm6,np.repeat(N,lengths),bc=bc)
+        jackknife_k = [jackknife_k[i] for i in range(6) if n[i]]
+
+        # deviations from the mean jackknife cumulant of each sample
+        for i in range(len(jackknife_k)):
+            jackknife_k[i] = jackknife_k[i] - np.repeat(np.add.reduceat(jackknife_k[i],starts)/N,lengths)
+
+        # 1/N normalized covariance within each sample, as in cumulants()
+        order = len(jackknife_k)
+        kcov = np.zeros([len(N),order,order])
+        for i in range(order):
+            for j in range(i,order):
+                kcov[:,i,j] = np.add.reduceat(jackknife_k[i]*jackknife_k[j],starts)/N
+                kcov[:,j,i] = kcov[:,i,j]
+
+        return k, kcov
+
+    return k
+
+##############################################################
+#############   bootcov()   ##########################
+##############################################################
+#
+# bootstrap estimate of the covariance of the sample cumulants.
+# The B resamples are drawn as one integer matrix of indices (in
+# blocks of at most BootBlock values, to bound memory) and their
+# cumulants found together from power sums of the deviations from
+# the sample mean, shifted to each resample's mean with the 
+# binomial expansion.  The resamples are made in parts of BootPart
+# with their own random streams, which may be shared out to a pool
+# of worker processes with the same result.
+#
+# input:
+# sample	array or list of wait times
+# B		number of resamples (default 1000)
+# n		number of orders, up to 6 (default 4)
+# bc		apply bias correction? (default True)
+# seed		None, integer or SeedSequence of the resampling
+# workers	number of worker processes (default 1: this process,
+#		None: all cores)
+#
+# output:
+# kcov		covariance of the cumulants of the resamples
+#
+BootBlock = 10**7	# most resampled values held at once
+BootPart = 100		# resamples of each random stream
+
+def bootcov(sample,B=1000,n=4,bc=True,seed=None,workers=1):
+
+#   process arguments
+    if type(n) == int:
+        n = np.concatenate( [np.ones(n),np.zeros(6-n)] )
+    n = np.array([bool(n[0]),bool(n[1]),bool(n[2]),bool(n[3]),bool(n[4]),bool(n[5])])
+    sample = np.asarray(sample,dtype=float).reshape(-1)
+
+#   resamples are made in parts of BootPart, each with its own
+#   random stream, so the result does not depend on workers
+    parts = [min(BootPart,B-first) for first in range(0,B,BootPart)]
+    tasks = [ (sample,parts[i],bc,stream) for i, stream in enumerate(sim.streams(seed,len(parts))) ]
+    if workers == 1:
+        k = np.concatenate([bootcumulants(task) for task in tasks])
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            k = np.concatenate(pool.map(bootcumulants,tasks))
+        finally:
+            pool.close()
+            pool.join()
+
+    return np.cov(k.transpose(),bias=False)[n][:,n]
+
+def bootcumulants(task):
+    """cumulants [B,6] of B resamples, task is (sample,B,bc,seed)"""
+
+    sample, B, bc, seed = task
+    rng = sim.generator(seed)
+    N = len(sample)
+    mean = np.mean(sample)
+    y = sample - mean
+    block = max(1,BootBlock//N)
+    k = np.zeros([B,6])
+    for first in range(0,B,block):
+        rows = min(block,B-first)
+        resample = y[rng.integers(0,N,[rows,N])]
+
+        # power sums S[p] of deviations from the sample mean
+        S = [np.full(rows,float(N))]
+        power = resample
+        for p in range(1,7):
+            S.append(power.sum(axis=1))
+            power = power*resample
+
+        # central moments about the resample mean d = S[1]/N
+        #   sum (y-d)^p = sum_q C(p,q) (-d)^(p-q) S[q]
+        d = S[1]/N
+        cm = []
+        for p in range(2,7):
+            cm.append(sum([binomial(p,q)*(-d)**(p-q)*S[q] for q in range(p+1)])/N)
+        k[first:first+rows] = np.array(moments_to_cumulants(mean+d,cm[0],cm[1],cm[2],cm[3],cm[4],N,bc)).T
+
+    return k
+
+##############################################################
+#############   SampleMoments   ##########################
+##############################################################
+#
+# cumulants and jackknife covariance of one sample, computed once 
+# and shared by every fit of that sample (e.g. every starting 
+# point of gmm.gmmG, or several weightings of the same data).
+# All six cumulants are found when the object is created, the 
+# 6X6 jackknife covariance the first time it is needed, and each 
+# weight matrix the first time it is asked for.  Any subset of
+# orders is taken from these cached values.
+#
+# input:
+# sample	array or list of wait times
+# bc		use bias corrected cumulants? (default True)
+#
+# use:
+# moments = SampleMoments(times)
+# moments.cumulants(n)		same as cumulants(times,n)
+# moments.kcov(n)		jackknife covariance, as cumulants(times,n,jack=True)[1]
+# moments.weight(n,diag)	inverse (or inverse of diagonal) of moments.kcov(n)
+# moments.bootstrap(B,seed,workers)	find the bootstrap covariance (see
+#				bootcov()), which is then used by 
+# moments.kcov(n,'boot')	and moments.weight(n,diag,'boot'), made with 
+#				the defaults if bootstrap() was not called
+#
+class SampleMoments(object):
+
+    def __init__(self,sample,bc=True):
+
+        self.sample = np.array(sample,dtype=float)
+        self.N = len(self.sample)
+        self.bc = bc
+        self.k = cumulants(self.sample,n=6,jack=False,bc=bc)
+        self.jackcov = None
+        self.bootcov = None
+        self.weights = {}
+
+    def mask(self,n):
+        """order argument as boolean array of length 6"""
+
+        if type(n) == int:
+            n = np.concatenate( [np.ones(n),np.zeros(6-n)] )
+
+        return np.array([bool(n[0]),bool(n[1]),bool(n[2]),bool(n[3]),bool(n[4]),bool(n[5])])
+
+    def cumulants(self,n=4):
+        """sample cumulants of the orders in n"""
+
+        return self.k[self.mask(n)]
+
+    def bootstrap(self,B=1000,seed=None,workers=1):
+        """find the bootstrap covariance of all six cumulants"""
+
+        self.bootcov = bootcov(self.sample,B=B,n=6,bc=self.bc,seed=seed,workers=workers)
+        self.weights = dict([(key,value) for key, value in self.weights.items() if key[2] != 'boot'])
+
+    def kcov(self,n=4,method='jack'):
+        """jackknife ('jack') or bootstrap ('boot') covariance of the
+        cumulants of the orders in n"""
+
+        n = self.mask(n)
+        if method == 'boot':
+            if self.bootcov is None:
+                self.bootstrap()
+            return self.bootcov[n][:,n]
+        if self.jackcov is None:
+            self.k, self.jackcov = cumulants(self.sample,n=6,jack=True,bc=self.bc)
+
+        return self.jackcov[n][:,n]
+
+    def weight(self,n=4,diag=False,method='jack'):
+        """jackknife or bootstrap weight matrix for the orders in n"""
+
+        key = (tuple(self.mask(n)),bool(diag),method)
+        if key not in self.weights:
+            kcov = self.kcov(n,method)
+            if diag==True:
+                self.weights[key] = np.diag(1.0/np.diag(kcov))
+            else:
+                self.weights[key] = np.linalg.inv(kcov)
+
+        return self.weights[key]
+
+##############################################################
+#############   CumulantAccumulator   ##########################
+##############################################################
+#
+# streaming cumulants of a sample that arrives in pieces.  Keeps
+# the count, the mean and the sums of powers of deviations from 
+# the mean M2..M6, updated one value or one chunk at a time.  A
+# chunk's own sums are found about its own mean and combined with
+# the running sums by the pairwise update of Pebay (2008), which is
+# also used to merge accumulators of different shards, so no power
+# sums about zero (which lose precision) are ever formed.
+# Accumulators can be pickled and sent between processes.
+#
+# input:
+# sample	optional first chunk of wait times
+#
+# use:
+# acc = CumulantAccumulator()
+# acc.add(chunk)		add one value or an array of values
+# acc.merge(other)		add the values of another accumulator
+# acc.cumulants(n,bc)		same as cumulants(all values,n,bc=bc)
+#
+class CumulantAccumulator(object):
+
+    def __init__(self,sample=None):
+
+        self.N = 0
+        self.mean = 0.0
+        self.M = np.zeros(7)	# M[p] = sum of (x-mean)^p, p = 2..6
+        if sample is not None:
+            self.add(sample)
+
+    def add(self,sample):
+        """add one value or an array of values"""
+
+        sample = np.array(sample,dtype=float).reshape(-1)
+        if len(sample) == 0:
+            return self
+        other = CumulantAccumulator()
+        other.N = len(sample)
+        other.mean = np.mean(sample)
+        deviation = sample - other.mean
+        power = deviation*deviation
+        for p in range(2,7):
+            other.M[p] = np.sum(power)
+            power = power*deviation
+
+        return self.merge(other)
+
+    def merge(self,other):
+        """add the values of another accumulator"""
+
+        if other.N == 0:
+            return self
+        if self.N == 0:
+            self.N, self.mean, self.M = other.N, other.mean, other.M.copy()
+            return self
+
+        na, nb = float(self.N), float(other.N)
+        n = na + nb
+        delta = other.mean - self.mean
+        M = self.M + other.M
+        for p in range(3,7):
+            for k in range(1,p-1):
+                M[p] += binomial(p,k)*( self.M[p-k]*(-nb*delta/n)**k + other.M[p-k]*(na*delta/n)**k )
+        for p in range(2,7):
+            M[p] += (na*nb*delta/n)**p*( 1.0/nb**(p-1) - (-1.0/na)**(p-1) )
+
+        self.N = self.N + other.N
+        self.mean = self.mean + delta*nb/n
+        self.M = M
+
+        return self
+
+    def cumulants(self,n=4,bc=True):
+        """cumulants of all values added, as cumulants(sample,n,bc=bc)"""
+
+        if type(n) == int:
+            n = np.concatenate( [np.ones(n),np.zeros(6-n)] )
+        n = np.array([bool(n[0]),bool(n[1]),bool(n[2]),bool(n[3]),bool(n[4]),bool(n[5])])
+        cm = self.M/self.N
+
+        return np.array(moments_to_cumulants(self.mean,cm[2],cm[3],cm[4],cm[5],cm[6],self.N,bc))[n]
+
+def binomial(a,b):
+    """binomial coefficient a choose b"""
+
+    return np.prod(np.arange(a-b+1,a+1))//np.prod(np.arange(1,b+1))
+
 ##############################################################
 #############   kcov()   ##########################
 ##############################################################
@@ -205,29 +799,187 @@ def cumulants(sample,n=4,jack=False,bc=True):
 # calculate the theoretical covariance matrix of the
 # sample cumulants using monte-carlo method.  Used in GMM
 #
+# all trials are simulated as one block and their cumulants found
+# together.  Results are kept in a least-recently-used cache 
+# (KcovCache, at most KcovCacheSize entries) keyed on tau rounded
+# to relative tolerance tol, N, trials and seed, so repeated calls
+# with nearly the same tau are not simulated again.  The full 4X4
+# matrix is cached and any order subset is taken from it.  When tol
+# is given the simulation uses the rounded tau.
+#
 # input:
 # tau		[tau1, tau2, ...]
 # N		sample size
 # trials	number of trials in calculation (default 500)
 # n		order of cumulants requested (default 4)
+# seed		None, integer or SeedSequence for the simulation
+#		(a Generator may be given, but is not cached)
+# tol		relative tolerance for rounding tau (default 1e-3), 
+#		None for exact tau
+# cache		use the cache? (default True)
 #
 # output:
 # kcov		the cumulant-covariance matrix
 #
-def kcov(tau,N,trials=500,n=4):
+def kcov(tau,N,trials=500,n=4,seed=None,tol=1e-3,cache=True):
 
 #   process arguments
     if type(n) == int:
         n = np.concatenate( [np.ones(n),np.zeros(4-n)] )
     n = np.array([bool(n[0]),bool(n[1]),bool(n[2]),bool(n[3])])
-    tau = np.array(tau)
+    tau = np.sort(np.array(tau,dtype=float).reshape(-1))
+    if tol is not None:
+        tau = roundtau(tau,tol)
+
+#   look for matrix in cache
+    key = None
+    if cache==True and not isinstance(seed,np.random.Generator):
+        if isinstance(seed,np.random.SeedSequence):
+            seedkey = (seed.entropy,tuple(seed.spawn_key))
+        else:
+            seedkey = seed
+        key = (tuple(tau),N,trials,seedkey)
+        if key in KcovCache:
+            KcovCache[key] = KcovCache.pop(key)  # now most recently used
+            return KcovCache[key][n][:,n]
 
-    k = np.zeros([trials,4])
-    for m in range(trials):
-        times = sim.multi_poissonN(tau,N)
-        k[m] = cumulants(times,n=4,jack=False,bc=True)
+    times = sim.multi_poissonBlock(tau,N,trials,seed=seed)
+    k = cumulantsN(times,n=4,jack=False,bc=True)
+    covariance = np.cov(k.transpose(),bias=False)
 
-    return np.cov(k.transpose(),bias=False)[n][:,n]
+    if key is not None:
+        KcovCache[key] = covariance
+        while len(KcovCache) > KcovCacheSize:
+            KcovCache.popitem(last=False)
+
+    return covariance[n][:,n]
+
+##############################################################
+#############   roundtau()   ##########################
+##############################################################
+#
+# round decay times to a relative tolerance, on a logarithmic grid
+# with spacing log(1+tol).  Zero is left unchanged.
+#
+def roundtau(tau,tol):
+
+    tau = np.array(tau,dtype=float)
+    magnitude = np.abs(tau)
+    nonzero = magnitude > 0
+    step = np.log1p(tol)
+    magnitude[nonzero] = np.exp(np.round(np.log(magnitude[nonzero])/step)*step)
+
+    return np.sign(tau)*magnitude
+
+##############################################################
+#############   hypocumulants()   ##########################
+##############################################################
+#
+# cumulants of the wait time of an N step process A->B->C...,
+# a sum of independent exponential times with means tau, are
+# (r-1)! * sum(tau^r)
+#
+# input:
+# tau		[tau1, tau2, ...], or array [P,steps]
+# order		number of cumulants (default 12)
+#
+# output:
+# kappa		array [order] (or [P,order]) of cumulants 1..order
+#
+def hypocumulants(tau,order=12):
+
+    tau = np.array(tau,dtype=float)
+    r = np.arange(1,order+1)
+    factorial = np.cumprod(np.concatenate([[1.0],r[:-1]]))
+
+    return factorial*np.sum(tau[...,None]**r,axis=-2)
+
+##############################################################
+#############   kcovanalytic()   ##########################
+##############################################################
+#
+# calculate the theoretical covariance matrix of the sample
+# cumulants exactly, from the cumulants of the N step process
+# (see hypocumulants()).  No simulation or table is needed and
+# any number of steps may be used.  See kcovanalyticN().
+#
+# input:
+# tau		[tau1, tau2, ...]
+# N		sample size
+# n		order of cumulants requested, up to 4 (default 4)
+#
+# output:
+# kcov		the cumulant-covariance matrix
+#
+def kcovanalytic(tau,N,n=4):
+
+    return kcovanalyticN([tau],N,n=n)[0]
+
+##############################################################
+#############   kcovanalyticN()   ##########################
+##############################################################
+#
+# calculate the theoretical covariance matrices of the sample
+# cumulants of many N step processes at once.
+#
+# the bias corrected cumulants 1-4 are Fisher's k-statistics, and
+# their covariances are the exact finite N formulas (Kendall and 
+# Stuart) in the population cumulants up to order 8.  These are the
+# covariances estimated by kcov() and kcovint() (bc=True).  Cumulants
+# 5 and 6 are not k-statistics, and no exact formula is used for 
+# them: the leading 1/N term is far from their covariance at the 
+# sample sizes of interest, so orders 5 and 6 raise ValueError.
+#
+# input:
+# tau		array [P,steps] of decay times
+# N		sample size, or array [P] of sample sizes
+# n		order of cumulants requested, up to 4 (default 4)
+#
+# output:
+# kcov		array [P,order,order] of cumulant-covariance matrices
+#
+def kcovanalyticN(tau,N,n=4):
+
+#   process arguments
+    if type(n) == int:
+        n = np.concatenate( [np.ones(n),np.zeros(6-n)] )
+    n = np.array([bool(n[0]),bool(n[1]),bool(n[2]),bool(n[3]),bool(n[4]),bool(n[5])])
+    tau = np.array(tau,dtype=float)
+    tau = tau.reshape(-1,tau.shape[-1])
+    P = tau.shape[0]
+    N = np.broadcast_to(np.array(N,dtype=float),[P])
+
+    if n[4] or n[5]:
+        raise ValueError("the analytic covariance is known for cumulants 1 to 4 only")
+
+#   cumulants 1..8, k[:,r] is order r (k1 is not used)
+    k = np.zeros([P,9])
+    k[:,1:] = hypocumulants(tau,8)
+
+#   exact covariances of the k-statistics k1..k4
+    a = 1.0/N
+    b = 1.0/(N-1.0)
+    c = N/(N-1.0)/(N-2.0)
+    d = N*(N+1.0)/(N-1.0)/(N-2.0)/(N-3.0)
+    exact = np.zeros([P,4,4])
+    exact[:,0,0] = a*k[:,2]
+    exact[:,0,1] = a*k[:,3]
+    exact[:,0,2] = a*k[:,4]
+    exact[:,0,3] = a*k[:,5]
+    exact[:,1,1] = a*k[:,4] + b*2.0*k[:,2]**2
+    exact[:,1,2] = a*k[:,5] + b*6.0*k[:,2]*k[:,3]
+    exact[:,1,3] = a*k[:,6] + b*(8.0*k[:,2]*k[:,4] + 6.0*k[:,3]**2)
+    exact[:,2,2] = ( a*k[:,6] + b*(9.0*k[:,2]*k[:,4] + 9.0*k[:,3]**2)
+                   + c*6.0*k[:,2]**3 )
+    exact[:,2,3] = ( a*k[:,7] + b*(12.0*k[:,2]*k[:,5] + 30.0*k[:,3]*k[:,4])
+                   + c*36.0*k[:,2]**2*k[:,3] )
+    exact[:,3,3] = ( a*k[:,8] + b*(16.0*k[:,2]*k[:,6] + 48.0*k[:,3]*k[:,5] + 34.0*k[:,4]**2)
+                   + c*(72.0*k[:,2]**2*k[:,4] + 144.0*k[:,2]*k[:,3]**2) + d*24.0*k[:,2]**4 )
+    for i in range(4):
+        for j in range(i):
+            exact[:,i,j] = exact[:,j,i]
+
+    return exact[:,n[:4]][:,:,n[:4]]
 
 ##############################################################
 #############   kcovint()   ##########################
@@ -235,52 +987,111 @@ def kcov(tau,N,trials=500,n=4):
 #
 # calculate the theoretical covariance matrix of the
 # sample cumulants using interpolation method.  
-# only works for two step reaction scheme, and for specific 
-# values of N
+# only works for two step reaction scheme.  See kcovintN() for 
+# how the table is interpolated
 #
 # input:
 # tau		[tau1, tau2]
 # N		sample size
 # n		order of cumulants requested (default 4)
+# table		CovarianceTable (default: the one set by initialize())
 #
 # output:
 # kcov		the cumulant-covariance matrix
 #
-def kcovint(tauIn,N,n=4):
+def kcovint(tauIn,N,n=4,table=None):
+
+    return kcovintN([tauIn],N,n=n,table=table)[0]
+
+##############################################################
+#############   kcovintN()   ##########################
+##############################################################
+#
+# calculate the theoretical covariance matrices of the sample
+# cumulants using interpolation method, for many (tau, N) at
+# once.  only works for two step reaction scheme.
+#
+# the table holds covariances for tau = [1, ratio] at the sample
+# sizes NumSamples and ratios TauTwo.  The table is interpolated
+# linearly in ratio, and linearly in 1/N after multiplying by N
+# (covariances of sample cumulants scale as 1/N), so any N may be
+# used.  Outside of the table the nearest entry is used (scaled 
+# by 1/N).  The result is scaled to tau1 by tau1^(i+j+2) for 
+# cumulants i,j = 0..3, taken from a table of powers of tau1.
+#
+# input:
+# tau		array [P,2] of [tau1, tau2] pairs
+# N		sample size, or array [P] of sample sizes
+# n		order of cumulants requested (default 4)
+# table		CovarianceTable (default: the one set by initialize())
+#
+# output:
+# kcov		array [P,order,order] of cumulant-covariance matrices
+#
+ScalePower = np.add.outer(np.arange(4),np.arange(4)) + 2
+
+def kcovintN(tau,N,n=4,table=None):
 
 #   process arguments
     if type(n) == int:
         n = np.concatenate( [np.ones(n),np.zeros(4-n)] )
     n = np.array([bool(n[0]),bool(n[1]),bool(n[2]),bool(n[3])])
-    tau = np.zeros(2)
-    tau[0] = np.min(tauIn)
-    tau[1] = np.max(tauIn)
-    s = tau[1]/tau[0]	#rescaled decay times
-    
-    # first convert N value to an index
-    Nindex = NumSamples.index(N)
-    
-    # now convert s to a pair of indices spanning s
-    # assume grandmatrix has s = 1,2,3,4,etc...
-    tIndexHi = int(np.floor(s))
-    tIndexLow = tIndexHi - 1
-    weightHi = s-np.floor(s)
-    weightLow = 1.0 - weightHi
-    if tIndexLow < 0:
-        tIndexHi = 0
-        tIndexLow = 0
-    if tIndexHi > (len(TauTwo)-1) :
-        tIndexHi = len(TauTwo)-1
-        tIndexLow = len(TauTwo)-1
-       
-    # here is the linear interpolation (maybe geometric interpolation better?)
-    kcovRAW = weightLow*GrandMatrix[Nindex,tIndexLow] + weightHi*GrandMatrix[Nindex,tIndexHi]
-    
-    # now calculate scale factors
-    factor = np.zeros([4,4])
-    for i in range(4):
-        for j in range(4):
-            factor[i,j]=tau[0]**(i+j+2)
+    tau = np.array(tau,dtype=float).reshape(-1,2)
+    taumin = np.min(tau,axis=1)
+    s = np.max(tau,axis=1)/taumin	#rescaled decay times
+    N = np.broadcast_to(np.array(N,dtype=float),s.shape)
+    if table is None:
+        if DefaultTable is None:
+            raise ValueError("no covariance table, call initialize() or give a table")
+        table = DefaultTable
+    ratios = table.TauTwo
+    sizes = table.NumSamples
+    GrandMatrix = table.GrandMatrix
+
+    # pairs of ratio indices spanning s, and weight of upper one
+    rHi, rLow, rWeight = bracket(ratios,s)
+
+    # pairs of N indices spanning N, interpolated in 1/N
+    nHi, nLow, nWeight = bracket(1.0/sizes[::-1],1.0/N)
+    nHi = len(sizes) - 1 - nHi
+    nLow = len(sizes) - 1 - nLow
+
+    # interpolate N*covariance, then divide by N
+    weight = lambda w: w[:,None,None]
+    scaled = lambda i, j: sizes[i][:,None,None]*GrandMatrix[i,j]
+    kcovRAW = ( (1.0-weight(nWeight))*( (1.0-weight(rWeight))*scaled(nLow,rLow) + weight(rWeight)*scaled(nLow,rHi) )
+              + weight(nWeight)*( (1.0-weight(rWeight))*scaled(nHi,rLow) + weight(rWeight)*scaled(nHi,rHi) ) )/weight(N)
+
+    # scale factors tau1^(i+j+2) from table of powers of tau1
+    powers = taumin[:,None]**np.arange(9)
+    factor = powers[:,ScalePower]
+
+    return (kcovRAW * factor)[:,n][:,:,n]
+
+##############################################################
+#############   bracket()   ##########################
+##############################################################
+#
+# find the pair of grid points spanning each value, for linear
+# interpolation.  Values outside of the grid use the end point.
+#
+# input:
+# grid		increasing array of grid points
+# x		array of values
+#
+# output:
+# hi, low	arrays of indices of grid points above and below x
+# weight	array of weights of the upper point (0 to 1)
+#
+def bracket(grid,x):
+
+    x = np.array(x,dtype=float)
+    if len(grid) == 1:
+        zero = np.zeros(x.shape,dtype=int)
+        return zero, zero, np.zeros(x.shape)
+    hi = np.clip(np.searchsorted(grid,x),1,len(grid)-1)
+    low = hi - 1
+    weight = np.clip((x-grid[low])/(grid[hi]-grid[low]),0.0,1.0)
 
-    return (kcovRAW * factor)[n][:,n]
+    return hi, low, weight
 
@@ -0,0 +1,211 @@
+############################################################
+############################################################
+#############   dwell.py   ##########################
+##############################################################
+############################################################
+#
+# Dwell time data module v20261017
+#
+# Loads dwell time data files (such as 22.dat, 44.dat ...), text
+# files with one wait time per line.  Each file is parsed once and
+# a binary copy is saved beside it (22.dat.npy, with the size and
+# modification time of the text file in 22.dat.json).  Later loads
+# memory map the binary copy, unless the text file has changed.
+#
+# A directory of files is loaded as one flat buffer holding every
+# file end to end, with an index of offsets, which is the form used
+# by the batched functions (see cumulant.segments()).  The buffer
+# is itself cached in the directory (dwell.npy and dwell.json), so
+# a directory that has not changed is mapped without any copying.
+#
+# example:
+# times = dwell.load('22.dat')
+# x, offsets, names = dwell.loaddir('.')
+# k = cu.cumulantsN(x,n=4,lengths=np.diff(offsets))
+#
+############################################################
+############################################################
+
+from __future__ import print_function
+import numpy as np
+import glob
+import json
+import os
+import tempfile
+
+CacheVersion = 1
+
+##############################################################
+#############   stamp()   ##########################
+##############################################################
+#
+# size and modification time (ns) of a file, used to decide if a
+# cache is still valid
+#
+def stamp(filename):
+
+    status = os.stat(filename)
+
+    return [int(status.st_size),int(status.st_mtime_ns)]
+
+##############################################################
+#############   parse()   ##########################
+##############################################################
+#
+# read a text file of wait times (whitespace separated, e.g. one
+# %.18e value per line) in a single bulk pass
+#
+# input:
+# filename	text file
+#
+# output:
+# times		float64 array of wait times
+#
+def parse(filename):
+
+    with open(filename) as infile:
+        text = infile.read()
+    fields = text.split()
+    times = np.array(fields,dtype=float)
+
+    return times
+
+##############################################################
+#############   writeatomic(), savecache()   ##########################
+##############################################################
+#
+# save an array as a .npy file together with a .json file holding
+# the stamps of its sources.  Both are written to temporary files
+# with unique names (so processes loading the same file at once do
+# not write over each other) and renamed, the .json last, so a
+# cache is never seen half made.  Raises OSError if the directory
+# can not be written.
+#
+def writeatomic(filename,write):
+
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                         prefix=os.path.basename(filename)+'.',suffix='.tmp')
+    try:
+        with os.fdopen(handle,'wb') as outfile:
+            write(outfile)
+        os.chmod(temporary,0o644)	# mkstemp makes it private
+        os.replace(temporary,filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+def savecache(npyfile,jsonfile,array,sources):
+
+    writeatomic(npyfile,lambda outfile: np.save(outfile,np.ascontiguousarray(array,dtype=float)))
+    manifest = json.dumps({'version':CacheVersion,'sources':sources})
+    writeatomic(jsonfile,lambda outfile: outfile.write(manifest.encode()))
+
+##############################################################
+#############   readcache()   ##########################
+##############################################################
+#
+# the sources recorded with a cache, or None if there is no
+# readable cache
+#
+def readcache(npyfile,jsonfile):
+
+    if not (os.path.exists(npyfile) and os.path.exists(jsonfile)):
+        return None
+    try:
+        with open(jsonfile) as infile:
+            manifest = json.load(infile)
+    except ValueError:
+        return None
+    if manifest.get('version') != CacheVersion:
+        return None
+
+    return manifest['sources']
+
+##############################################################
+#############   load()   #####################################
+##############################################################
+#
+def load(filename,cache=True,mmap_mode='r'):
+    """load a text file of wait times.
+
+    input:
+    filename    text file, one wait time per line
+    cache       use and make the binary cache filename.npy?
+                (default True).  The cache is used only if the
+                size and modification time of filename are those
+                recorded in filename.json, otherwise it is remade.
+                If it can not be written (e.g. a read only
+                directory) the parsed times are returned
+    mmap_mode   mode used to memory map the cache (default 'r',
+                read only), None reads it into memory
+    output:
+    times       array of wait times"""
+
+    if cache == False:
+        return parse(filename)
+
+    npyfile, jsonfile = filename + '.npy', filename + '.json'
+    current = {os.path.basename(filename):stamp(filename)}
+    if readcache(npyfile,jsonfile) != current:
+        times = parse(filename)
+        try:
+            savecache(npyfile,jsonfile,times,current)
+        except OSError:		# e.g. a read only directory, no cache
+            return times
+
+    return np.load(npyfile,mmap_mode=mmap_mode)
+
+##############################################################
+#############   loaddir()   #####################################
+##############################################################
+#
+def loaddir(path,pattern='*.dat',cache=True,mmap_mode='r'):
+    """load every data file of a directory into one buffer.
+
+    input:
+    path        directory
+    pattern     file name pattern (default '*.dat')
+    cache       use and make binary caches? (default True).  Each
+                file is cached as by load(), and the whole buffer in
+                path/dwell.npy, which is remade when any file is
+                added, removed or changed
+    mmap_mode   mode used to memory map the buffer (default 'r')
+    output:
+    x           flat array of all wait times, files end to end, in
+                order of names
+    offsets     integer array [files+1], file i is
+                x[offsets[i]:offsets[i+1]]
+    names       list of file names"""
+
+    files = sorted(glob.glob(os.path.join(path,pattern)))
+    names = [os.path.basename(filename) for filename in files]
+
+    if cache == False:
+        times = [parse(filename) for filename in files]
+    else:
+        npyfile = os.path.join(path,'dwell.npy')
+        jsonfile = os.path.join(path,'dwell.json')
+        current = [[name]+stamp(filename) for name, filename in zip(names,files)]
+        sources = readcache(npyfile,jsonfile)
+        if sources is not None and [source[:3] for source in sources] == current:
+            lengths = [source[3] for source in sources]
+            x = np.load(npyfile,mmap_mode=mmap_mode)
+            return x, np.concatenate([[0],np.cumsum(lengths)]).astype(int), names
+        times = [load(filename,cache=True) for filename in files]
+
+    lengths = [len(t) for t in times]
+    offsets = np.concatenate([[0],np.cumsum(lengths)]).astype(int)
+    if len(times) > 0:
+        x = np.concatenate(times)
+    else:
+        x = np.zeros(0)
+
+    if cache == True:
+        try:
+            savecache(npyfile,jsonfile,x,[c+[l] for c, l in zip(current,lengths)])
+            x = np.load(npyfile,mmap_mode=mmap_mode)
+        except OSError:		# e.g. a read only directory, no cache
+            pass
+
+    return x, offsets, names
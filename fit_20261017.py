@@ -0,0 +1,187 @@
+############################################################
+############################################################
+#############   fit.py   ##########################
+##############################################################
+############################################################
+#
+# Batch fitting module v20261017
+#
+# Command line program that fits every dwell time file of a
+# directory (or list of files / glob patterns) with gmm.gmmG, on a
+# pool of worker processes.  One line is written for each file as
+# soon as its fit is done, as CSV or JSON lines.  Files are loaded
+# with the dwell module, so they are parsed only once.
+#
+# example:
+# python fit.py data/ --steps 2 --order 3 --weight jack -o fits.csv
+# python fit.py 'run1/*.dat' run2/ --steps 2 --weight int --table grandmatrix.pkl
+# python fit.py data/ --steps 3 --order 4 --start mom
+#
+# the decay times are written smallest first, with the value of the
+# cost function.  A file that can not be fit (e.g. too few wait
+# times for the order) gets an error message instead.
+#
+############################################################
+############################################################
+
+from __future__ import print_function
+import numpy as np
+import argparse
+import csv
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import cumulant as cu
+import gmm
+import dwell
+
+##############################################################
+#############   datafiles()   ##########################
+##############################################################
+#
+# list the data files named by a list of directories, files and
+# glob patterns, in order, without repeats
+#
+# input:
+# paths		list of directories, files or patterns
+# pattern	pattern of data files in directories (default '*.dat')
+#
+# output:
+# files		list of file names
+#
+def datafiles(paths,pattern='*.dat'):
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = sorted(glob.glob(os.path.join(path,pattern)))
+        else:
+            found = sorted(glob.glob(path))
+        for filename in found:
+            if filename not in files:
+                files.append(filename)
+
+    return files
+
+##############################################################
+#############   startlist()   ##########################
+##############################################################
+#
+# initial values for the global search of one sample.  The decay
+# times add up to the mean wait time, so each is taken from a
+# logarithmic grid of num values from mean/100 to mean, and every
+# combination (smallest first) is used.
+#
+# input:
+# mean		mean wait time of the sample
+# steps		number of steps
+# num		number of grid values (default 3)
+#
+# output:
+# taulist	array [points,steps] of initial values
+#
+def startlist(mean,steps,num=3):
+
+    grid = mean*np.geomspace(0.01,1.0,num)
+
+    return np.array(list(itertools.combinations_with_replacement(grid,steps)))
+
+def fitfile(task):
+    """fit one file, task is a tuple built by main()"""
+
+    filename, steps, order, weight, diag, grid, table, start = task
+    row = {'file':filename}
+    begin = time.time()
+    try:
+        times = dwell.load(filename)
+        row['N'] = len(times)
+        moments = cu.SampleMoments(times)
+        if start == 'mom':
+            tau, value = gmm.gmmM(moments,steps,n=order,diag=diag,weight=weight,table=table,verbose=True)
+        else:
+            taulist = startlist(moments.k[0],steps,grid)
+            tau = gmm.gmmG(moments,taulist,n=order,diag=diag,weight=weight,table=table)
+            tau, value = gmm.gmm(moments,tau,n=order,diag=diag,weight=weight,verbose=True,table=table)
+        for i in range(steps):
+            row['tau%d' % (i+1)] = float(tau[i])
+        row['cost'] = float(value)
+    except Exception as error:
+        row['error'] = '%s: %s' % (type(error).__name__,error)
+    row['seconds'] = time.time() - begin
+
+    return row
+
+##############################################################
+#############   main()   #####################################
+##############################################################
+#
+def main(argv=None):
+    """command line entry point, see python fit.py --help"""
+
+    parser = argparse.ArgumentParser(description="fit dwell time files with the generalized method of moments")
+    parser.add_argument('paths',nargs='+',help="directories, files or glob patterns of data files")
+    parser.add_argument('--pattern',default='*.dat',help="data files in directories (default *.dat)")
+    parser.add_argument('--steps',type=int,default=2,help="number of steps of the model (default 2)")
+    parser.add_argument('--order',type=int,default=None,help="order of the method, up to 6 (default: steps)")
+    parser.add_argument('--weight',default='jack',choices=['jack','boot','iden','int','analytic','mc'],
+                        help="weight matrix (default jack)")
+    parser.add_argument('--diag',action='store_true',help="use the diagonal of the covariance matrix")
+    parser.add_argument('--grid',type=int,default=3,help="initial values per step for the global search (default 3)")
+    parser.add_argument('--start',default='grid',choices=['grid','mom'],
+                        help="initial values: grid search, or method of moments (gmm.gmmM) (default grid)")
+    parser.add_argument('--table',default='grandmatrix.pkl',help="covariance table for --weight int")
+    parser.add_argument('--workers',type=int,default=None,help="worker processes (default: all cores)")
+    parser.add_argument('-o','--output',default=None,help="output file (default: standard output)")
+    parser.add_argument('--format',choices=['csv','jsonl'],default=None,
+                        help="output format (default: from the output file name, else csv)")
+    args = parser.parse_args(argv)
+
+    files = datafiles(args.paths,args.pattern)
+    if len(files) == 0:
+        parser.error("no data files found")
+    order = args.order if args.order is not None else args.steps
+    table = cu.CovarianceTable(args.table) if args.weight == 'int' else None
+    form = args.format
+    if form is None:
+        form = 'jsonl' if args.output is not None and args.output.endswith(('.jsonl','.json')) else 'csv'
+
+    tasks = [ (filename,args.steps,order,args.weight,args.diag,args.grid,table,args.start) for filename in files ]
+    if args.workers == 1:
+        pool = None
+        finished = map(fitfile,tasks)
+    else:
+        pool = multiprocessing.Pool(args.workers)
+        finished = pool.imap_unordered(fitfile,tasks)
+
+    outfile = sys.stdout if args.output is None else open(args.output,'w')
+    fields = ['file','N'] + ['tau%d' % (i+1) for i in range(args.steps)] + ['cost','seconds','error']
+    if form == 'csv':
+        writer = csv.DictWriter(outfile,fieldnames=fields)
+        writer.writeheader()
+    failed = 0
+    try:
+        for row in finished:
+            if form == 'csv':
+                writer.writerow(row)
+            else:
+                outfile.write(json.dumps(row) + '\n')
+            outfile.flush()
+            failed = failed + ('error' in row)
+    finally:
+        if pool is not None:	# all results are in, or the run was stopped
+            pool.terminate()
+            pool.join()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+    if failed > 0:
+        print(failed,"of",len(files),"files could not be fit",file=sys.stderr)
+
+    return 0 if failed == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,7 +8,8 @@
 #
 ########################################################
 # The script will test  GMM for one step process run all in a loop so don't
-# have to store large amounts of simulated data
+# have to store large amounts of simulated data.  The trials are run
+# in parallel with the sweep module
 #
 #  A  - >  B
 #
@@ -36,49 +37,20 @@ order = [1,2,3,4]
 trials = 1000
 tauRange = [[1.0],[10.0],[100.0],[1000.0]]
 
-# initialize arrays to hold results
-# these hold results for identity matrix
-tempAi = zeros(trials)
-meanAi = zeros([len(N),len(order)])
-meandevAi = zeros([len(N),len(order)])
-stdAi = zeros([len(N),len(order)])
-seAi = zeros([len(N),len(order)])
-
-# these hold results for diagonal jackknife
-tempAd = zeros(trials)
-meanAd = zeros([len(N),len(order)])
-meandevAd = zeros([len(N),len(order)])
-stdAd = zeros([len(N),len(order)])
-seAd = zeros([len(N),len(order)])
-
-# these hold results for full jackknife
-tempAf = zeros(trials)
-meanAf = zeros([len(N),len(order)])
-meandevAf = zeros([len(N),len(order)])
-stdAf = zeros([len(N),len(order)])
-seAf = zeros([len(N),len(order)])
-
-print "now calculating tau1 =",tau1
-for j in range(len(N)): # loop through numbers of samples
-    print "   ...N =", N[j]
-    for k in range(len(order)): # loop through orders
-        print "      ...order =", order[k]
-        for n in range(trials): 
-            times = sim.multi_poissonN([tau1],N[j])
-            junki=gmm.gmmG(times,tauRange,n=order[k],diag=True,weight='iden',bc=True )
-            tempAi[n]=junki  # this is smallest decay time
-           
-            junkd=gmm.gmmG(times,tauRange,n=order[k],diag=True,weight='jack',bc=True )
-            tempAd[n]=junkd  # this is smallest decay time
-
-            junkf=gmm.gmmG(times,tauRange,n=order[k],diag=False,weight='jack',bc=True )
-            tempAf[n]=junkf  # this is smallest decay time
-
-        meanAi[j,k],meandevAi[j,k],stdAi[j,k],seAi[j,k] = cu.stats(tempAi)
-        meanAd[j,k],meandevAd[j,k],stdAd[j,k],seAd[j,k] = cu.stats(tempAd)
-        meanAf[j,k],meandevAf[j,k],stdAf[j,k],seAf[j,k] = cu.stats(tempAf)
-          
-
+# run on all cores, random streams are fixed by seed
+workers = None
+seed = 0
 
+# directory in which finished cells are saved, a restarted run with the
+# same store skips them (None: keep results in memory only)
+store = None
 
+# fits done on every trial: identity matrix, diagonal jackknife and
+# full jackknife.  results for fit 'i' are meanAi, meandevAi, etc.
+fits = [ {'name':'i','diag':True,'weight':'iden'},
+         {'name':'d','diag':True,'weight':'jack'},
+         {'name':'f','diag':False,'weight':'jack'} ]
 
+results = sweep.run([[tau1]],N,order,trials,tauRange,fits,seed=seed,workers=workers,store=store)
+for name in results:
+    globals()[name] = results[name][0]
@@ -8,7 +8,8 @@
 #
 ########################################################
 # The script will test  GMM for 3 step process run all in a loop so don't
-# have to store large amounts of simulated data.  
+# have to store large amounts of simulated data.  The trials are run
+# in parallel with the sweep module.
 #
 # basic parameters are
 # N[] = list of number of samples (molecules)
@@ -36,50 +37,18 @@ order = [ 3,4 ]
 trials = 1000
 initialtau = [ [ 1.0, 1.0, 1.0 ], [ 1.0, 1.0, 10.0 ], [ 1.0, 1.0, 100.0 ], [ 1.0, 1.0, 1000.0 ], [ 1.0, 10.0, 10.0 ], [ 1.0, 10.0, 100.0 ], [ 1.0, 10.0, 1000.0 ], [ 1.0, 100.0, 100.0 ], [ 1.0, 100.0, 1000.0 ], [ 1.0, 1000.0, 1000.0 ], [ 10.0, 10.0, 10.0 ], [ 10.0, 10.0, 100.0 ], [ 10.0, 10.0, 1000.0 ], [ 10.0, 100.0, 100.0 ], [ 10.0, 100.0, 1000.0 ], [ 10.0, 1000.0, 1000.0 ], [ 100.0, 100.0, 100.0 ], [ 100.0, 100.0, 1000.0 ], [ 100.0, 1000.0, 1000.0 ], [ 1000.0, 1000.0, 1000.0 ]]
 
-# initialize arrays to hold results
-# these hold results for tauA
-tempA = zeros(trials)
-meanA = zeros([len(tau),len(N),len(order)])
-meandevA = zeros([len(tau),len(N),len(order)])
-stdA = zeros([len(tau),len(N),len(order)])
-seA = zeros([len(tau),len(N),len(order)])
-# these hold results for tauB
-tempB = zeros(trials)
-meanB = zeros([len(tau),len(N),len(order)])
-meandevB = zeros([len(tau),len(N),len(order)])
-stdB = zeros([len(tau),len(N),len(order)])
-seB = zeros([len(tau),len(N),len(order)])
-# these hold results for tauC
-tempC = zeros(trials)
-meanC = zeros([len(tau),len(N),len(order)])
-meandevC = zeros([len(tau),len(N),len(order)])
-stdC = zeros([len(tau),len(N),len(order)])
-seC = zeros([len(tau),len(N),len(order)])
-
-for i in range(len(tau)): # loop through tau values
-    print "now calculating tau2 =",tau[i]
-    for j in range(len(N)): # loop through numbers of samples
-        print "   ...N =", N[j]
-        for k in range(len(order)):
-            print "      ...order =", order[k]
-            for n in range(trials): 
-                times = sim.multi_poissonN(tau[i],N[j])
-
-                junk=gmm.gmmG(times,initialtau,n=order[k],diag=True,weight='jack',bc=True )
-                tempA[n]=junk[0]  # this is smallest decay time
-                tempB[n]=junk[1]  # this is middle decay time
-                tempC[n]=junk[2]  # this is largest decay time
-
-            meanA[i,j,k],meandevA[i,j,k],stdA[i,j,k],seA[i,j,k] = cu.stats(tempA)
-            meanB[i,j,k],meandevB[i,j,k],stdB[i,j,k],seB[i,j,k] = cu.stats(tempB)
-            meanC[i,j,k],meandevC[i,j,k],stdC[i,j,k],seC[i,j,k] = cu.stats(tempC)
- 
-
-
-
-
-
-
+# run on all cores, random streams are fixed by seed
+workers = None
+seed = 0
 
+# directory in which finished cells are saved, a restarted run with the
+# same store skips them (None: keep results in memory only)
+store = None
 
+# fit done on every trial: diagonal jackknife.  results are meanA, meanB,
+# meanC, etc.
+fits = [ {'name':'','diag':True,'weight':'jack'} ]
 
+results = sweep.run(tau,N,order,trials,initialtau,fits,seed=seed,workers=workers,store=store)
+for name in results:
+    globals()[name] = results[name]
@@ -13,9 +13,160 @@
 ############################################################
 ############################################################
 
+from __future__ import print_function
 import numpy as np
 from scipy.optimize import leastsq, minimize
+from scipy.linalg import eigvals
+from scipy.signal import convolve2d
 import cumulant as cu
+import json
+import time
+
+############################################################
+############# define global variable
+##################################################
+
+# profiler receiving a record of every gmm() and gmmG() call, None
+# (the default) to record nothing.  Set by instrument()
+Instrument = None
+clock = getattr(time,'perf_counter',time.time)
+
+##############################################################
+#############   Profiler   ##########################
+##############################################################
+#
+# collects the records made by gmm() and gmmG() while instrument()
+# is on.  A record is a dictionary of one call: wall times of its 
+# stages in seconds, counts such as BFGS iterations, flags such as
+# convergence, the condition number of kcov and strings such as 
+# the weight.  Records are aggregated as they arrive, so memory 
+# does not grow with the number of calls: numbers are summed and 
+# counted in histograms with bins a quarter decade wide, flags are
+# counted when True and strings are counted by value.  Profilers of
+# different processes can be merged.
+#
+# records made (keys present depend on the options of the call):
+#   'gmm'	moments, jackknife, bootstrap, kcov, inverse, minimize,
+#		total (s)
+#		iterations, fevals, gevals (bfgs only), cond, converged,
+#		basin, weight=..., solver=..., diag
+#   'gmmG'	moments, screen, search, total (s), starts
+#
+# use:
+# profile = gmm.instrument()
+# ... fits ...
+# profile.report()
+# profile.dump('profile.json')
+# gmm.instrument(False)
+#
+class Profiler(object):
+
+    Edges = 10.0**np.arange(-8.0,20.25,0.25)	# histogram bin edges
+
+    def __init__(self):
+
+        self.calls = {}
+        self.sums = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def add(self,kind,record):
+        """aggregate the record of one call"""
+
+        self.calls[kind] = self.calls.get(kind,0) + 1
+        sums = self.sums.setdefault(kind,{})
+        counters = self.counters.setdefault(kind,{})
+        histograms = self.histograms.setdefault(kind,{})
+        for key in record:
+            value = record[key]
+            if isinstance(value,(bool,np.bool_)):
+                counters[key] = counters.get(key,0) + int(value)
+            elif isinstance(value,str):
+                name = key + '=' + value
+                counters[name] = counters.get(name,0) + 1
+            elif value is not None:
+                sums[key] = sums.get(key,0.0) + float(value)
+                if key not in histograms:
+                    histograms[key] = np.zeros(len(self.Edges)+1,dtype=int)
+                histograms[key][np.searchsorted(self.Edges,value)] += 1
+
+    def merge(self,other):
+        """add the aggregates of another profiler"""
+
+        for kind in other.calls:
+            self.calls[kind] = self.calls.get(kind,0) + other.calls[kind]
+            sums = self.sums.setdefault(kind,{})
+            counters = self.counters.setdefault(kind,{})
+            histograms = self.histograms.setdefault(kind,{})
+            for key in other.sums[kind]:
+                sums[key] = sums.get(key,0.0) + other.sums[kind][key]
+            for key in other.counters[kind]:
+                counters[key] = counters.get(key,0) + other.counters[kind][key]
+            for key in other.histograms[kind]:
+                histograms[key] = histograms.get(key,0) + other.histograms[kind][key]
+
+        return self
+
+    def summary(self):
+        """aggregates as a dictionary, for each kind of record the
+        number of calls, the totals, means (over the calls having
+        the key) and counters, and histograms as lists of 
+        [low edge, high edge, count] of non-empty bins"""
+
+        edges = np.concatenate([[0.0],self.Edges,[np.inf]])
+        summary = {}
+        for kind in self.calls:
+            histograms = {}
+            means = {}
+            for key in self.histograms[kind]:
+                counts = self.histograms[kind][key]
+                histograms[key] = [ [float(edges[i]),float(edges[i+1]),int(counts[i])] for i in np.nonzero(counts)[0] ]
+                means[key] = self.sums[kind][key]/counts.sum()
+            summary[kind] = {'calls':self.calls[kind],'total':dict(self.sums[kind]),'mean':means,
+                             'counters':dict(self.counters[kind]),'histograms':histograms}
+
+        return summary
+
+    def dump(self,filename):
+        """write summary() to a JSON file"""
+
+        with open(filename,'w') as outfile:
+            json.dump(self.summary(),outfile,indent=1,sort_keys=True)
+
+    def report(self):
+        """print the totals, means and counters"""
+
+        summary = self.summary()
+        for kind in sorted(summary):
+            print(kind,summary[kind]['calls'],"calls")
+            for key in sorted(summary[kind]['total']):
+                print('   %-12s total %12.6g   mean %12.6g' % (key,summary[kind]['total'][key],summary[kind]['mean'][key]))
+            for key in sorted(summary[kind]['counters']):
+                print('   %-12s count %12d' % (key,summary[kind]['counters'][key]))
+
+##############################################################
+#############   instrument()   ##########################
+##############################################################
+#
+# turn instrumentation of gmm() and gmmG() on or off.  When off
+# (the default) no timing or other record is made.
+#
+# input:
+# on		True to record, False to stop (default True)
+# profiler	Profiler to record into (default: a new one)
+#
+# output:
+# profiler	the Profiler now recording, or None
+#
+def instrument(on=True,profiler=None):
+
+    global Instrument
+    if on == True:
+        Instrument = profiler if profiler is not None else Profiler()
+    else:
+        Instrument = None
+
+    return Instrument
 
 ##############################################################
 #############   residual()   ##########################
@@ -128,82 +279,264 @@ def dcost(tau,k,w,n):
     
     return 2.0*np.dot(g,np.dot(w,dg)) # dcost = 2gWg'
 
+##############################################################
+#############   ordermask()   ##########################
+##############################################################
+#
+# converts the order argument of gmm() into an array of 1/0 values
+# indicating which cumulants are used.  At least as many cumulants
+# as steps are always used.
+#
+# input:
+# n		order of method up to 6, or array of 1/0 values
+# numparams	number of steps
+#
+# output:
+# n		array [a,b,c,d,e,f] of 1.0/0.0 values
+#
+def ordermask(n,numparams):
+    """order argument of gmm as array of 1/0 values"""
+
+    if type(n) == int:
+        if n<numparams:
+            n = np.concatenate( [np.ones(numparams),np.zeros(6-numparams)] )
+        else:
+            nmax = min(n,6)
+            n = np.concatenate( [np.ones(nmax),np.zeros(6-nmax)] )
+    else:
+        n = np.array(n,dtype=float)
+    if n.sum()<numparams:
+        n = np.concatenate( [np.ones(numparams),np.zeros(6-numparams)] )
+
+    return n
+
+##############################################################
+#############   weights()   ##########################
+##############################################################
+#
+# returns the sample cumulants and weight matrix used by gmm()
+#
+# input:
+# moments	cumulant.SampleMoments of the sample
+# tau0		initial guess, used by 'mc', 'int' and 'analytic' weights
+# n		array [a,b,c,d,e,f] of 1/0 values (see ordermask())
+# diag, weight, table	see gmm()
+# record	dictionary receiving stage times and the condition 
+#		number of kcov when instrument() is on (default None)
+# seed		seed of the 'mc' simulation (default None)
+#
+# output:
+# k, w		sample cumulants and weight matrix
+#
+def weights(moments,tau0,n,diag,weight,table=None,record=None,seed=None):
+    """sample cumulants and weight matrix for gmm"""
+
+    k = moments.cumulants(n)
+    if record is not None:
+        start = clock()
+    if weight in ['jack','boot']:  # use jackknife or bootstrap estimate
+        if record is None:
+            return k, moments.weight(n,diag,weight)
+        kcov = moments.kcov(n,weight)
+        record['jackknife' if weight=='jack' else 'bootstrap'] = clock() - start
+        start = clock()
+        w = moments.weight(n,diag,weight)
+        record['inverse'] = clock() - start
+        record['cond'] = np.linalg.cond(kcov)
+        return k, w
+    elif weight=='mc':  # use montecarlo method
+        kcov = cu.kcov(tau0,moments.N,trials=500,n=n,seed=seed)
+    elif weight=='int': # use interpolation method
+        kcov = cu.kcovint(tau0,moments.N,n=n,table=table)
+    elif weight=='analytic': # use exact covariance of N step process
+        kcov = cu.kcovanalytic(tau0,moments.N,n=n)
+    elif weight=='iden': # set weight=identity matrix
+        kcov = np.identity(int(np.sum(n)))
+
+    if record is not None:
+        record['kcov'] = clock() - start
+        start = clock()
+    if diag==True:
+        w = np.diag(1.0/np.diag(kcov))
+    elif diag==False:
+        w = np.linalg.inv(kcov)
+    if record is not None:
+        record['inverse'] = clock() - start
+        record['cond'] = np.linalg.cond(kcov)
+
+    return k, w
+
+class BasinFound(Exception):
+    """raised to stop a minimization that has reached a known minimum"""
+
+    def __init__(self,index):
+        Exception.__init__(self,index)
+        self.index = index
+
 ##############################################################
 #############   gmm()   #####################################
 ##############################################################
 #
-def gmm(t,tau0,n=1,diag=False,weight='jack',verbose=False,bc=True):
+def gmm(t,tau0,n=1,diag=False,weight='jack',verbose=False,bc=True,basins=None,basintol=1e-3,table=None,solver='bfgs',
+        update=None,maxpasses=20,passtol=1e-6,seed=None):
     """GMM for N step process, with a weight matrix, number of
     steps is determined by length of tau0=[tau10,tau20, ...]
 
     input: 
-    t        array of sample times
+    t        array of sample times, or a cumulant.SampleMoments
+             object of the sample (its bc is used, not the bc here)
     tau0     initial guess time constants [tau10, tau20, ...] 
     n        order of method up to 6 (default = number of steps)
              or an array 1/0 values indicating which cumulants to use.
              for example, [0,1,1,0,0,0] indicates use cumulants 2 and 3
     diag     if True, use diagonalized covariance matrix
     weight   'jack': estimate covariance with jackknife method
+             'boot': estimate covariance with bootstrap method, 1000
+                     resamples unless bootstrap() of a SampleMoments
+                     t was called (see cumulant.bootcov)
              'mc': use monte-carlo method to calculate covariance
              'int': use interpolation method to calculate covariance
+             'analytic': exact covariance of the N step process
+                         with decay times tau0 (see cumulant.kcovanalytic),
+                         orders up to 4 only
              'iden': sets weight = identity matrix
+    table    cumulant.CovarianceTable used by weight='int' (default: 
+             the table set by cumulant.initialize())
     verbose  set to True if you want cost function value returned also
              this is necessary for global searches
+    basins   list of minima already found, e.g. by other starting
+             points of a global search.  If the iterates come within
+             relative distance basintol of one of them the
+             minimization stops and that minimum is returned
+    solver   'bfgs': BFGS minimization in tau (default)
+             'newton': Newton iteration in log(tau) with the exact
+                       Hessian (see gmmN(logtau=True)).  Converges
+                       in a few iterations and keeps tau positive, a
+                       decay time whose best value is 0 is returned
+                       as a tiny positive number.  tau0 must be 
+                       positive (zeros are raised to 1e-6 of the
+                       largest) and basins is not used.  Unlike
+                       BFGS, a start with equal decay times is not
+                       held on the saddle at tauA = tauB
+    update   for the weights 'mc', 'int' and 'analytic', which are
+             found at tau0 (other weights do not depend on tau, and
+             giving update with them raises ValueError):
+             None: one fit with the weight at tau0 (default)
+             'iterate': iterated GMM, the weight is found again at
+                        the last estimate and the fit repeated from
+                        it until tau changes by less than passtol
+                        (relative) or maxpasses fits are done
+             'cue': continuously updated GMM, the weight is found 
+                    at every tau tried by a BFGS minimization in 
+                    log(tau), with a finite difference gradient.
+                    Not possible with 'mc'
+             the sample cumulants are found once for all passes
+    seed     None, integer or SeedSequence of the simulation used by 
+             weight='mc' (see cumulant.kcov), default None: unseeded
     output:
     tau      estimates of decay times [tau1, tau2, ...]"""
   
+#   iterated and continuously updated GMM
+    if update not in [None,'iterate','cue']:
+        raise ValueError("unknown update '%s'" % update)
+    if update is not None and weight not in ['mc','int','analytic']:
+        raise ValueError("update='%s' needs a weight found at tau, 'mc', 'int' or 'analytic'" % update)
+    if update is not None:
+        if isinstance(t,cu.SampleMoments):
+            moments = t
+        else:
+            moments = cu.SampleMoments(t,bc=bc)
+        tau = np.sort(np.array(tau0,dtype=float))
+        if update == 'iterate':
+            for fit in range(maxpasses):
+                last = tau
+                tau, value = gmm(moments,last,n=n,diag=diag,weight=weight,verbose=True,table=table,solver=solver,seed=seed)
+                if np.max(np.abs(tau-last)/np.abs(last)) < passtol:
+                    break
+        elif update == 'cue':
+            if weight == 'mc':
+                raise ValueError("update='cue' needs a smooth weight, 'int' or 'analytic'")
+            mask = ordermask(n,len(tau))
+            def cuecost(u):
+                k, w = weights(moments,np.exp(u),mask,diag,weight,table)
+                return cost(np.exp(u),k,w,mask.astype(bool))
+            result = minimize(cuecost,np.log(np.abs(tau)),method='BFGS',options={'gtol':1e-8,'disp':False})
+            tau, value = np.sort(np.exp(result['x'])), result['fun']
+        if verbose == True:
+            return tau, value
+        else:
+            return tau
+
 #   process inputs
-    times = np.array(t)
+    record = None
+    if Instrument is not None:
+        record = {'weight':weight,'diag':bool(diag),'solver':solver}
+        begin = clock()
+    if isinstance(t,cu.SampleMoments):
+        moments = t
+    else:
+        moments = cu.SampleMoments(t,bc=bc)
+    if record is not None:
+        record['moments'] = clock() - begin
     tau0 = np.array(tau0) 
+    if solver == 'newton':
+        tau0 = np.maximum(np.abs(tau0),1e-6*np.max(np.abs(tau0)))
     numparams = len(tau0) 
-    if type(n) == int:
-        if n<numparams:
-            n = np.concatenate( [np.ones(numparams),np.zeros(6-numparams)] )
-        else:
-            nmax = min(n,6)
-            n = np.concatenate( [np.ones(nmax),np.zeros(6-nmax)] )
-    else:
-        n = np.array(n)
-    order = n.sum()
-    if order<numparams:
-        n = np.concatenate( [np.ones(numparams),np.zeros(6-numparams)] )
+    n = ordermask(n,numparams)
+    order = int(n.sum())
 
 #   calculate cumulants and weights
-    if weight=='jack':  # use jackknife estimate
-        k, kcov = cu.cumulants(times,n=n,jack=True,bc=bc)
-    elif weight=='mc':  # use montecarlo method
-        k = cu.cumulants(times,n=n,jack=False,bc=bc)
-        kcov = cu.kcov(tau0,len(t),trials=500,n=n)
-    elif weight=='int': # use interpolation method
-        k = cu.cumulants(times,n=n,jack=False,bc=bc)
-        kcov = cu.kcovint(tau0,len(t),n=n)
-    elif weight=='iden': # set weight=identity matrix
-        k = cu.cumulants(times,n=n,jack=False,bc=bc)
-        kcov = np.identity(order)
-
-    if diag==True:
-        w = np.diag(1.0/np.diag(kcov))
-    elif diag==False:
-        w = np.linalg.inv(kcov)
+    k, w = weights(moments,tau0,n,diag,weight,table,record,seed)
 
 #   perform minimization
     n = [bool(n[0]),bool(n[1]),bool(n[2]),bool(n[3]),bool(n[4]),bool(n[5])]  # set boolean values before minimization
-    result = minimize(cost,tau0,args=(k,w,n),method='BFGS',jac=dcost,options={'gtol': 1e-8, 'disp': False})
+    callback = None
+    if basins is not None and len(basins) > 0:
+        known = np.sort(np.array(basins,dtype=float),axis=1)
+        def callback(x):
+            distance = np.max(np.abs(np.sort(x)-known)/np.abs(known),axis=1)
+            if np.min(distance) < basintol:
+                raise BasinFound(np.argmin(distance))
+    if record is not None:
+        start = clock()
+    if solver == 'newton':
+        tau, value, converged = gmmN(k[None],w[None],tau0,n,verbose=True,logtau=True)
+        tau, value = tau[0], value[0]
+        if record is not None:
+            record['converged'] = bool(converged[0])
+    else:
+        try:
+            result = minimize(cost,tau0,args=(k,w,n),method='BFGS',jac=dcost,callback=callback,options={'gtol': 1e-8, 'disp': False})
+            tau, value = np.sort(result['x']), result['fun']
+            if record is not None:
+                record.update({'iterations':result['nit'],'fevals':result['nfev'],'gevals':result['njev'],
+                               'converged':bool(result['success'])})
+        except BasinFound as found:
+            tau = known[found.index]
+            value = cost(tau,k,w,n)
+            if record is not None:
+                record['basin'] = True
+    if record is not None:
+        record['minimize'] = clock() - start
+        record['total'] = clock() - begin
+        Instrument.add('gmm',record)
 
 #   return result and cost function value minimum if needed
     if verbose == True:
-        return np.sort(result['x']),result['fun']
+        return tau, value
     else:
-        return np.sort(result['x'])
+        return tau
 
 ##############################################################
 #############   gmmG()   #####################################
 ##############################################################
 #
-def gmmG(t,taulist,n=1,diag=False,weight='jack',bc=True):
+def gmmG(t,taulist,n=1,diag=False,weight='jack',bc=True,screen=None,basintol=None,table=None,solver='bfgs'):
     """a global search wrapper for gmm.  see gmm.gmm() for complete
     list of input.  Here, input taulist is a list of initial values
-    to try.  Number of steps is determined from list.  
+    to try.  Number of steps is determined from list.  Input t may
+    be a cumulant.SampleMoments object, which lets several calls on 
+    the same sample share its cumulants and weights.
 
     input: 
     taulist	list of initial values to try.  For example, for 
@@ -211,41 +544,605 @@ def gmmG(t,taulist,n=1,diag=False,weight='jack',bc=True):
 		[ [10,10],[10,20],[10,30],[20,20],[20,30],[30,0] ]
 		this example would perform 6 minimizations and
 		return the results that yield the overall minimum
+    screen	if given, the cost at every initial value is found
+		first and only the screen values with the lowest cost 
+		are minimized, best first (default None: minimize all).
+		This is a heuristic, not only a speed-up: the global 
+		minimum may lie in the basin of a start with a high 
+		initial cost, and then a worse minimum is returned 
+		(e.g. 3 of 30 samples of a 3 step process with screen=5)
+    basintol	if given, a minimization stops as soon as it comes 
+		within this relative distance of a minimum found from
+		an earlier initial value (e.g. 1e-3, default None)
+    solver	'bfgs' or 'newton', see gmm.gmm()
     output:
     tau     	estimates of decay times [tau1, tau2] which
 		minimizes cost function in region specified"""
 
-    taulist = np.array(taulist)
+    # cumulants and weights are computed once for all starting points
+    record = None
+    if Instrument is not None:
+        record = {}
+        begin = clock()
+    if isinstance(t,cu.SampleMoments):
+        moments = t
+    else:
+        moments = cu.SampleMoments(t,bc=bc)
+    taulist = np.array(taulist,dtype=float)
     numpoints = len(taulist)
     nsteps = len(taulist[0])
+    if record is not None:
+        record['moments'] = clock() - begin
+        watch = clock()
+
+    # rank initial values by their cost, all evaluated together
+    if screen is not None:
+        mask = ordermask(n,nsteps)
+        kw = [weights(moments,tau,mask,diag,weight,table) for tau in taulist]
+        start = costN(taulist,np.array([kk for kk, ww in kw]),np.array([ww for kk, ww in kw]),mask)
+        taulist = taulist[np.argsort(start)[:screen]]
+        numpoints = len(taulist)
+    if record is not None:
+        record['screen'] = clock() - watch
+        record['starts'] = numpoints
+        watch = clock()
+
     decay = np.zeros([numpoints,nsteps])
     value = np.zeros([numpoints])
+    found = []
     i = 0
     for tau in taulist:
-        result=gmm(t,tau,n=n,diag=diag,weight=weight,verbose=True,bc=bc) 
-	result[0].sort()
+        if basintol is None:
+            result=gmm(moments,tau,n=n,diag=diag,weight=weight,verbose=True,bc=bc,table=table,solver=solver) 
+        else:
+            result=gmm(moments,tau,n=n,diag=diag,weight=weight,verbose=True,bc=bc,basins=found,basintol=basintol,table=table,solver=solver)
+        result[0].sort()
         decay[i] = result[0]
         value[i] = result[1]
+        if basintol is not None and not any([np.array_equal(result[0],m) for m in found]):
+            found.append(result[0])
         i = i + 1
             
+    if record is not None:
+        record['search'] = clock() - watch
+        record['total'] = clock() - begin
+        Instrument.add('gmmG',record)
+
     minindex = np.argmin(value)
     return decay[minindex]
 
+##############################################################
+#############   momstart()   ##########################
+##############################################################
+#
+# initial values from the method of moments.  For an m step 
+# process the cumulants give the power sums of the decay times,
+#   p_r = tau1^r + tau2^r + ... = k_r/(r-1)!
+# and Newton's identities turn the first m of them into the 
+# elementary symmetric functions e_r of tau,
+#   e_r = (1/r) sum_{i=1..r} (-1)^(i-1) e_(r-i) p_i
+# so the decay times are the roots of
+#   x^m - e_1 x^(m-1) + e_2 x^(m-2) - ... + (-1)^m e_m
+# If the roots are real and positive they are the only initial 
+# value.  Otherwise (the sample cumulants of small samples often 
+# give complex or negative roots) a few targeted initial values 
+# are returned: the moduli of the roots, the m-1 step solution 
+# with a short extra step, and the mean split equally.
+#
+# input:
+# k		sample cumulants [k1, k2, ... km] (at least m)
+# steps		number of steps m
+#
+# output:
+# taulist	array [points,steps] of initial values, smallest first
+#
+def momstart(k,steps):
 
+    factorial = [1.0,1.0,2.0,6.0,24.0,120.0]
+    p = [k[r]/factorial[r] for r in range(steps)]
+    e = [1.0]
+    for r in range(1,steps+1):
+        e.append(sum([(-1)**(i-1)*e[r-i]*p[i-1] for i in range(1,r+1)])/r)
+    roots = np.roots([(-1)**r*e[r] for r in range(steps+1)])
+    if np.all(np.abs(roots.imag) <= 1e-9*np.abs(roots)) and np.all(roots.real > 0.0):
+        return np.sort(roots.real).reshape(1,steps)
 
+    mean = k[0]
+    taulist = [np.sort(np.abs(roots))]
+    if steps > 1:
+        shorter = momstart(k,steps-1)[0]
+        taulist.append(np.sort(np.concatenate([[0.1*np.min(shorter)],shorter])))
+    taulist.append(np.full(steps,mean/steps))
+    taulist = np.array(taulist)
 
+    return taulist[np.all(np.isfinite(taulist) & (taulist > 0.0),axis=1)]
+
+##############################################################
+#############   gmmM()   #####################################
+##############################################################
+#
+def gmmM(t,steps,n=1,diag=False,weight='jack',bc=True,table=None,solver='bfgs',verbose=False):
+    """GMM for N step process started from the method of moments
+    (see momstart()), with no list of initial values.  A single
+    minimization is done when the first steps cumulants give real
+    positive decay times, otherwise a global search (gmm.gmmG) of a
+    few targeted initial values.  See gmm.gmm() for input.
 
+    input:
+    steps    number of steps (up to 6)
+    output:
+    tau      estimates of decay times [tau1, tau2, ...]
+    tau, value    if verbose=True"""
 
+    if isinstance(t,cu.SampleMoments):
+        moments = t
+    else:
+        moments = cu.SampleMoments(t,bc=bc)
+    taulist = momstart(moments.k,steps)
 
+    if len(taulist) == 1:
+        tau, value = gmm(moments,taulist[0],n=n,diag=diag,weight=weight,verbose=True,table=table,solver=solver)
+    else:
+        tau = gmmG(moments,taulist,n=n,diag=diag,weight=weight,table=table,solver=solver)
+        tau, value = gmm(moments,tau,n=n,diag=diag,weight=weight,verbose=True,table=table,solver=solver)
 
+    if verbose == True:
+        return tau, value
+    else:
+        return tau
 
+##############################################################
+#############   costN()   ##########################
+##############################################################
+#
+# vectorized GMM cost function, residuals and derivatives for a 
+# stack of P problems at once.  Rows of tau, k and w belong to the
+# same problem.
+#
+# input:
+# tau	array [P,steps] of lifetimes
+# k	array [P,order] of measured cumulants
+# w	array [P,order,order] of weight matrices
+# n	[a,b,c,d,e,f] boolean values indicating cumulants used
+# derivs	also return gradient and Hessian? (default False)
+#
+# output:
+# cost			array [P] of costs, if derivs=False
+# cost, grad, hess	if derivs=True, grad is [P,steps] and 
+#			hess is [P,steps,steps]
+#
+def costN(tau,k,w,n,derivs=False):
+    """vectorized GMM cost function for P problems"""
 
+    tau = np.array(tau,dtype=float)
+    n = np.array(n,dtype=bool)
+    p = np.arange(1,7)
+    factorial = np.array([1.0,1.0,2.0,6.0,24.0,120.0,720.0])
 
+    # powers tau^0 ... tau^6, array [P,steps,7]
+    powers = tau[:,:,None]**np.arange(7)
 
+    # theoretical cumulants (p-1)! sum tau^p and residuals, [P,order]
+    theory = factorial[p-1]*powers[:,:,1:].sum(axis=1)
+    g = theory[:,n] - k
+    wg = np.einsum('pab,pb->pa',w,g)
+    value = np.einsum('pa,pa->p',g,wg)
+    if derivs == False:
+        return value
 
+    # derivatives of residuals, dg[p,a,j] = d g_a / d tau_j = a! tau_j^(a-1)
+    dg = (factorial[p]*powers[:,:,:6])[:,:,n].transpose(0,2,1)
+    # second derivatives are diagonal in tau, d2g = a!(a-1) tau_j^(a-2)
+    d2g = np.zeros(powers[:,:,:6].shape)
+    d2g[:,:,1:] = factorial[p[1:]]*(p[1:]-1)*powers[:,:,:5]
+    d2g = d2g[:,:,n].transpose(0,2,1)
 
+    grad = 2.0*np.einsum('pa,paj->pj',wg,dg)
+    hess = 2.0*np.einsum('paj,pab,pbk->pjk',dg,w,dg)
+    hess[:,np.arange(tau.shape[1]),np.arange(tau.shape[1])] += 2.0*np.einsum('pa,paj->pj',wg,d2g)
 
+    return value, grad, hess
 
+##############################################################
+#############   logcostN()   ##########################
+##############################################################
+#
+# costN() as a function of u = log(tau), used by the log-tau solver.
+# With tau = exp(u) the derivatives are
+#   grad_u = tau*grad
+#   hess_u = tau_j*hess_jk*tau_k + diag(tau*grad)
+# input and output as costN(), with u in place of tau
+#
+def logcostN(u,k,w,n,derivs=False):
+    """vectorized GMM cost function of log decay times"""
 
+    tau = np.exp(np.array(u,dtype=float))
+    if derivs == False:
+        return costN(tau,k,w,n)
+    value, grad, hess = costN(tau,k,w,n,derivs=True)
+    grad = tau*grad
+    hess = tau[:,:,None]*hess*tau[:,None,:]
+    hess[:,np.arange(tau.shape[1]),np.arange(tau.shape[1])] += grad
 
+    return value, grad, hess
 
+##############################################################
+#############   gmmN()   #####################################
+##############################################################
+#
+def gmmN(k,w,tau0,n,verbose=False,maxiter=200,xtol=1e-10,logtau=False):
+    """vectorized GMM for a stack of P problems, solved together
+    with a damped Newton iteration using the exact gradient and 
+    Hessian of the cost.  Each problem stops
+    iterating once it has converged.
+
+    input: 
+    k        array [P,order] of sample cumulants, as returned by 
+             cumulant.cumulantsN()
+    w        array [P,order,order] of weight matrices, or a single
+             [order,order] matrix used for every problem
+    tau0     initial guesses, array [P,steps] or a single [steps]
+             guess used for every problem
+    n        order of method, see gmm.gmm().  Must agree with k
+    verbose  set to True to also return cost values and a mask of
+             converged problems
+    maxiter  maximum number of iterations (default 200)
+    xtol     relative change in tau for convergence (default 1e-10)
+    logtau   if True, iterate in u = log(tau), which scales decay 
+             times of different size alike and keeps them positive.
+             Steps are limited to a factor e^2 in each tau (a
+             trust region), and tau0 must be positive (default False)
+    output:
+    tau      array [P,steps] of sorted decay times
+    tau, value, converged    if verbose=True"""
+
+#   process inputs
+    k = np.array(k,dtype=float)
+    if k.ndim == 1:
+        k = k.reshape(-1,1)
+    numproblems = len(k)
+    tau = np.array(tau0,dtype=float)
+    if tau.ndim == 1:
+        tau = np.tile(tau,[numproblems,1])
+    numparams = tau.shape[1]
+    n = ordermask(n,numparams).astype(bool)
+    order = n.sum()
+    w = np.array(w,dtype=float)
+    if w.ndim == 2:
+        w = np.tile(w,[numproblems,1,1])
+    k = k.reshape(numproblems,order)
+    w = w.reshape(numproblems,order,order)
+
+#   damped Newton iteration on the problems that are still active,
+#   in tau or in log(tau)
+    if logtau == True:
+        function = logcostN
+        tau = np.log(tau)
+        slack = 1e-14	# steps may raise the cost by rounding error
+        reachscale = 0.5	# least step from a saddle, in log(tau)
+    else:
+        function = costN
+        slack = 0.0
+        reachscale = 0.1	# least step from a saddle, relative to tau
+    damping = np.full(numproblems,1e-3)
+    converged = np.zeros(numproblems,dtype=bool)
+    stuck = np.zeros(numproblems,dtype=bool)
+    value = function(tau,k,w,n)
+    for iteration in range(maxiter):
+        active = np.flatnonzero(~(converged | stuck))
+        if len(active) == 0:
+            break
+        value[active], grad, hess = function(tau[active],k[active],w[active],n,derivs=True)
+
+        # Newton step with the curvature taken in absolute value,
+        # damped relative to the largest curvature of each problem.
+        # The cost is symmetric in the decay times, so on a line of
+        # equal decay times (e.g. tauA = tauB) the gradient has no
+        # part along the direction that separates them, and such a
+        # point can be a saddle.  Along directions of negative
+        # curvature the step is given a least length (shrinking as
+        # steps are rejected), so that it leaves the saddle.
+        curvature, vectors = np.linalg.eigh(hess)
+        negative = curvature < -1e-8*np.abs(curvature).max(axis=1)[:,None]
+        saddle = negative.any(axis=1)
+        curvature = np.abs(curvature)
+        curvature = curvature + damping[active,None]*curvature.max(axis=1)[:,None] + 1e-300
+        projection = np.einsum('pjk,pj->pk',vectors,grad)
+        component = -projection/curvature
+        reach = reachscale*np.minimum(1.0,1e-3/damping[active])
+        if logtau == False:
+            reach = reach*np.abs(tau[active]).max(axis=1)
+        escape = -np.where(projection > 0.0,1.0,-1.0)*reach[:,None]
+        component = np.where(negative & (np.abs(component) < reach[:,None]),escape,component)
+        step = np.einsum('pjk,pk->pj',vectors,component)
+        if logtau == True:
+            step = step*np.minimum(2.0/np.maximum(np.max(np.abs(step),axis=1),1e-300),1.0)[:,None]
+        trial = tau[active] + step
+        newvalue = function(trial,k[active],w[active],n)
+
+        # accept steps that lower the cost, otherwise increase damping
+        accept = np.isfinite(newvalue) & (newvalue <= value[active]*(1.0+slack))
+        if logtau == True:
+            # a decay time heading to zero (the best positive fit has
+            # tau = 0) does not stop moving, it is done once it is
+            # below xtol times the largest
+            bound = trial < np.log(xtol) + trial.max(axis=1)[:,None]
+            small = np.all((np.abs(step) <= xtol) | bound,axis=1)
+        else:
+            small = np.all(np.abs(step) <= xtol*(np.abs(tau[active])+xtol),axis=1)
+        tau[active[accept]] = trial[accept]
+        value[active[accept]] = newvalue[accept]
+        damping[active] = np.where(accept,np.maximum(damping[active]/10.0,1e-12),damping[active]*10.0)
+        # a saddle point is never converged
+        converged[active] = (accept & small & ~saddle) | (value[active] == 0.0)
+        stuck[active] = damping[active] > 1e16
+    if logtau == True:
+        tau = np.exp(tau)
+
+#   return result and cost function value minimum if needed
+    if verbose == True:
+        return np.sort(tau,axis=1), value, converged
+    else:
+        return np.sort(tau,axis=1)
+
+##############################################################
+#############   gmmGN()   #####################################
+##############################################################
+#
+def gmmGN(k,w,taulist,n,maxiter=200,xtol=1e-10):
+    """a global search wrapper for gmmN.  Every problem is started 
+    from every point of taulist (all solved together) and the 
+    result with the lowest cost is returned for each problem.  See 
+    gmm.gmmN() and gmm.gmmG() for input.
+
+    output:
+    tau      array [P,steps] of decay times which minimize the cost
+             function of each problem in the region specified"""
+
+    k = np.array(k,dtype=float)
+    if k.ndim == 1:
+        k = k.reshape(-1,1)
+    numproblems = len(k)
+    taulist = np.array(taulist,dtype=float)
+    numpoints = len(taulist)
+    w = np.array(w,dtype=float)
+    if w.ndim == 2:
+        w = np.tile(w,[numproblems,1,1])
+
+    # problem i, start point j is row i*numpoints+j
+    decay, value, converged = gmmN(np.repeat(k,numpoints,axis=0),np.repeat(w,numpoints,axis=0),
+                                   np.tile(taulist,[numproblems,1]),n,verbose=True,maxiter=maxiter,xtol=xtol)
+    decay = decay.reshape(numproblems,numpoints,-1)
+    minindex = np.argmin(value.reshape(numproblems,numpoints),axis=1)
+
+    return decay[np.arange(numproblems),minindex]
+
+##############################################################
+#############   powersums()   ##########################
+##############################################################
+#
+# power sums a^r + b^r of two decay times as polynomials in
+# s = a+b and p = a*b, found with Newton's recurrence 
+#   P[r] = s*P[r-1] - p*P[r-2]
+#
+# input:
+# order		highest power
+#
+# output:
+# P		list of arrays [order+1,order+1], P[r][i,j] is the
+#		coefficient of s^i p^j in a^r + b^r
+#
+def powersums(order):
+
+    P = [np.zeros([order+1,order+1]) for r in range(order+1)]
+    P[0][0,0] = 2.0
+    P[1][1,0] = 1.0
+    for r in range(2,order+1):
+        P[r][1:,:] += P[r-1][:-1,:]
+        P[r][:,1:] -= P[r-2][:,:-1]
+
+    return P
+
+##############################################################
+#############   polycost()   ##########################
+##############################################################
+#
+# the cost function of a two step process as a polynomial in
+# s = a+b and p = a*b
+#
+# input:
+# k, w, n	as cost()
+#
+# output:
+# C		array, C[i,j] is the coefficient of s^i p^j
+#
+def polycost(k,w,n):
+
+    n = np.array(n,dtype=bool)
+    orders = np.arange(1,7)[n]
+    top = orders.max()
+    P = powersums(top)
+    factorial = [1.0,1.0,1.0,2.0,6.0,24.0,120.0]
+    g = []
+    for a in range(len(orders)):
+        residual = factorial[orders[a]]*P[orders[a]]
+        residual[0,0] -= k[a]
+        g.append(residual)
+    C = np.zeros([2*top+1,2*top+1])
+    for a in range(len(orders)):
+        for b in range(len(orders)):
+            if w[a][b] != 0.0:
+                C += w[a][b]*convolve2d(g[a],g[b])
+
+    return C
+
+##############################################################
+#############   polyroots()   ##########################
+##############################################################
+#
+# all real solutions (s,p) with p > 0 of two polynomial equations
+# f(s,p) = 0, g(s,p) = 0.  s is eliminated with the Sylvester 
+# matrix of f and g, a matrix polynomial S(p) = sum_j S_j p^j whose
+# determinant (the resultant) vanishes at the p of every solution.
+# These p are the eigenvalues of its companion linearization
+#   A = [ 0    I    0  ...      ]     B = [ I          ]
+#       [ 0    0    I  ...      ]         [    I       ]
+#       [ -S_0 -S_1 ... -S_d-1  ]         [       S_d  ]
+# and for each real one the s are the real roots of f(s,p).
+#
+# input:
+# f, g		arrays, f[i,j] is the coefficient of s^i p^j
+# imagtol	largest relative imaginary part of a real root
+#
+# output:
+# list of (s,p)
+#
+def polyroots(f,g,imagtol=1e-6):
+
+    def trim(h):
+        rows = np.flatnonzero(np.any(h != 0.0,axis=1))
+        columns = np.flatnonzero(np.any(h != 0.0,axis=0))
+        return h[:rows.max()+1,:columns.max()+1]
+    f, g = trim(f), trim(g)
+    df, dg = f.shape[0]-1, g.shape[0]-1
+    degree = max(f.shape[1],g.shape[1]) - 1
+    size = df + dg
+    if size == 0 or degree == 0:
+        return []
+
+    # Sylvester matrix, S[j] is the coefficient matrix of p^j
+    S = np.zeros([degree+1,size,size])
+    for row in range(dg):
+        S[:f.shape[1],row,row:row+df+1] = f.T
+    for row in range(df):
+        S[:g.shape[1],dg+row,row:row+dg+1] = g.T
+    S = S/np.max(np.abs(S))
+
+    # companion linearization, eigenvalues are the p
+    A = np.zeros([size*degree,size*degree])
+    B = np.identity(size*degree)
+    A[:-size,size:] = np.identity(size*(degree-1))
+    for j in range(degree):
+        A[-size:,j*size:(j+1)*size] = -S[j]
+    B[-size:,-size:] = S[degree]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        eigenvalues = eigvals(A,B)
+    eigenvalues = eigenvalues[np.isfinite(eigenvalues)]
+    real = np.abs(eigenvalues.imag) <= imagtol*np.maximum(np.abs(eigenvalues),1.0)
+    pvalues = np.unique(eigenvalues[real].real)
+
+    solutions = []
+    for p in pvalues[pvalues > 0.0]:
+        for s in realroots(np.dot(f,p**np.arange(f.shape[1])),imagtol):
+            solutions.append((s,p))
+
+    return solutions
+
+def realroots(coefficients,imagtol=1e-6):
+    """real positive roots of the polynomial sum_i c_i x^i"""
+
+    coefficients = np.trim_zeros(np.array(coefficients,dtype=float)[::-1],'f')
+    if len(coefficients) < 2:
+        return []
+    roots = np.roots(coefficients)
+    real = (np.abs(roots.imag) <= imagtol*np.maximum(np.abs(roots),1.0)) & (roots.real > 0.0)
+
+    return list(roots[real].real)
+
+##############################################################
+#############   gmmR()   #####################################
+##############################################################
+#
+def gmmR(t,steps=2,n=None,diag=False,weight='jack',bc=True,tau0=None,table=None,verbose=False):
+    """GMM for 1 or 2 step processes with a global minimum found
+    from all the stationary points of the cost, with no initial
+    values (see gmm.gmmG for the multi-start search).  The residuals
+    are power sums of tau, so the stationary points solve a 
+    polynomial system.  For 2 steps it is written in s = tauA+tauB,
+    p = tauA*tauB (symmetric in tauA, tauB), s is eliminated with a
+    resultant and the p are found as eigenvalues of a companion
+    matrix (see polyroots()).  Stationary points with tauA = tauB
+    and minima on the boundary tauA = 0 are roots of polynomials in
+    one variable.  All are scaled by the sample mean first.  The
+    lowest cost candidates are polished with the log-tau Newton
+    solver and the best is returned.
+
+    input: 
+    t        array of sample times, or a cumulant.SampleMoments
+    steps    1 or 2
+    n        order of method (default: steps + 1 for 2 steps, 1 
+             for 1 step), see gmm.gmm()
+    diag, weight, bc, table     see gmm.gmm()
+    tau0     decay times at which the covariance is found for 
+             weight 'mc', 'int' or 'analytic'
+    verbose  set to True to also return the cost
+    output:
+    tau      estimates of decay times [tauA, tauB], smallest first.
+             A decay time at the bound is 0
+    tau, value    if verbose=True"""
+
+#   process inputs
+    if steps not in [1,2]:
+        raise ValueError("gmmR solves 1 or 2 step processes, use gmmG for %d steps" % steps)
+    if weight not in ['jack','iden'] and tau0 is None:
+        raise ValueError("weight '%s' needs tau0" % weight)
+    if isinstance(t,cu.SampleMoments):
+        moments = t
+    else:
+        moments = cu.SampleMoments(t,bc=bc)
+    if n is None:
+        n = steps + 1 if steps == 2 else 1
+    mask = ordermask(n,steps)
+    k, w = weights(moments,tau0,mask,diag,weight,table)
+    n = mask.astype(bool)
+
+#   scale decay times by the sample mean, the cost is unchanged
+    scale = moments.k[0]
+    powers = np.arange(1,7)[n]
+    ks = k/scale**powers
+    ws = w*scale**np.add.outer(powers,powers)
+    ws = ws/np.max(np.abs(ws))
+
+#   candidates from the stationary points of the scaled cost
+    candidates = []
+    if steps == 1:
+        C = np.polynomial.Polynomial(polycost(ks,ws,n)[:,0])	# p = 0: C(s) with s = tau
+        for root in realroots(C.deriv().coef):
+            candidates.append([root])
+    else:
+        C = polycost(ks,ws,n)
+        ds = C[1:,:]*np.arange(1,C.shape[0])[:,None]
+        dp = C[:,1:]*np.arange(1,C.shape[1])[None,:]
+        for s, p in polyroots(ds,dp):
+            discriminant = s*s - 4.0*p
+            if discriminant >= -1e-6*s*s:
+                root = np.sqrt(max(discriminant,0.0))
+                candidates.append([(s-root)/2.0,(s+root)/2.0])
+        # tauA = tauB = x: C(2x,x^2), and the boundary tauA = 0: C(x,0)
+        x = np.polynomial.Polynomial([0.0,1.0])
+        equal = sum([C[i,j]*(2.0*x)**i*(x*x)**j for i in range(C.shape[0]) for j in range(C.shape[1])])
+        bound = np.polynomial.Polynomial(C[:,0])
+        for root in realroots(equal.deriv().coef):
+            candidates.append([root,root])
+        for root in realroots(bound.deriv().coef):
+            candidates.append([0.0,root])
+    if len(candidates) == 0:
+        raise ValueError("no real positive stationary point of the cost")
+
+#   polish the best candidates in log tau, keep the lowest cost
+    candidates = np.array(candidates)*scale
+    values = np.array([cost(tau,k,w,n) for tau in candidates])
+    best = candidates[np.argsort(values)[:3]]
+    interior = np.all(best > 0.0,axis=1)
+    if np.any(interior):
+        polished, polishvalue, converged = gmmN(np.tile(k,[interior.sum(),1]),np.tile(w,[interior.sum(),1,1]),
+                                                best[interior],n,verbose=True,logtau=True)
+        best = np.concatenate([best,polished])
+    values = np.array([cost(tau,k,w,n) for tau in best])
+    tau = np.sort(best[np.argmin(values)])
+    value = np.min(values)
+
+    if verbose == True:
+        return tau, value
+    else:
+        return tau
@@ -0,0 +1,476 @@
+############################################################
+############################################################
+#############   serve.py   ##########################
+##############################################################
+############################################################
+#
+# Local fitting service module v20261017 (python 3)
+#
+# An asyncio server, on a Unix socket or a localhost TCP port, that
+# fits samples of wait times sent to it by acquisition programs.
+# Requests are collected for a short window (Window seconds, or
+# until MaxBatch have arrived), those with the same fit settings are
+# fit together with the batched functions cumulant.cumulantsN,
+# gmm.gmmN and gmm.gmmGN on a pool of workers, and each request is
+# answered with its decay times and latencies.  The server goes on
+# collecting the next window while a batch is being fit.
+#
+# protocol: one JSON object per line each way, e.g. the request
+#   {"id": 7, "times": [3.1, 12.0, ...], "steps": 2, "order": 3,
+#    "weight": "jack", "diag": false}
+# is answered with
+#   {"id": 7, "N": 500, "tau": [8.9, 21.4], "cost": 0.41, "batch": 12,
+#    "latency": {"queued": 0.010, "fit": 0.031, "total": 0.042}}
+# or with {"id": 7, "error": "..."}.  Responses on a connection are
+# written as their batches finish, so they may come back out of
+# order and are matched by id.
+#
+# request keys:
+# id		any JSON value, returned with the response
+# times		list of wait times
+# steps		number of steps (default 2)
+# order		order of method, up to 6 (default steps)
+# weight	'jack', 'iden' or 'analytic' (orders up to 4) (default 'jack')
+# diag		use the diagonal of the covariance matrix (default false)
+# bc		use bias corrected cumulants (default true)
+# tau0		initial values [tau1, tau2, ...].  If not given, a grid of
+#		initial values scaled by the mean wait time is searched
+#		(see fit.startlist()).  'analytic' fits without tau0
+#		start from the 'jack' fit of the same sample
+#
+# response latencies (seconds):
+# queued	from arrival until its batch was sent to a worker
+# fit		time taken to fit the whole batch
+# total		from arrival until the response was ready
+#
+# example:
+# python serve.py --socket /tmp/gmm.sock --workers 2
+#
+# and from a client program:
+# responses = serve.request('/tmp/gmm.sock',[{'times':list(t),'steps':2}])
+#
+# or, without any socket, in one program:
+# server = serve.Server(workers=1)
+# response = await server.submit({'times':list(t),'steps':2})
+#
+############################################################
+############################################################
+
+from __future__ import print_function
+import numpy as np
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+import cumulant as cu
+import gmm
+import fit
+
+Window = 0.01		# seconds requests are collected before a batch is fit
+MaxBatch = 256		# most requests fit in one batch
+LineLimit = 2**27	# longest request line in bytes (about 5 million wait times)
+WEIGHTS = ['jack','iden','analytic']
+clock = getattr(time,'perf_counter',time.time)
+
+##############################################################
+#############   settings()   ##########################
+##############################################################
+#
+# check a request and return its fit settings.  Requests with equal
+# settings are fit together.
+#
+# input:
+# request	dictionary, see above
+#
+# output:
+# settings	tuple (steps, order, weight, diag, bc)
+# times		array of wait times
+# tau0		array of initial values, or None
+#
+def settings(request):
+
+    if not isinstance(request,dict) or 'times' not in request:
+        raise ValueError("request must be an object with 'times'")
+    times = np.array(request['times'],dtype=float).reshape(-1)
+    steps = int(request.get('steps',2))
+    order = request.get('order',None)
+    order = steps if order is None else int(order)
+    weight = request.get('weight','jack')
+    if not 1 <= steps <= 6:
+        raise ValueError("steps must be 1 to 6")
+    if not steps <= order <= 6:
+        raise ValueError("order must be from steps to 6")
+    if weight not in WEIGHTS:
+        raise ValueError("unknown weight '%s', use one of %s" % (weight,', '.join(WEIGHTS)))
+    if weight == 'analytic' and order > 4:
+        raise ValueError("weight 'analytic' is for orders up to 4")
+    if len(times) <= order+1:
+        raise ValueError("%d wait times are too few for order %d" % (len(times),order))
+    if not np.all(np.isfinite(times)):
+        raise ValueError("wait times must be finite")
+
+    tau0 = request.get('tau0',None)
+    if tau0 is not None:
+        tau0 = np.array(tau0,dtype=float).reshape(-1)
+        if len(tau0) != steps or not np.all(tau0 > 0.0):
+            raise ValueError("tau0 must be %d positive values" % steps)
+
+    return (steps,order,weight,bool(request.get('diag',False)),bool(request.get('bc',True))), times, tau0
+
+##############################################################
+#############   fitgroup()   ##########################
+##############################################################
+#
+# fit samples that share settings, all together.  Each sample is
+# fit in units of its mean wait time (cumulant r divided by mean^r
+# and the weight matrix scaled to match), which leaves the cost
+# unchanged and lets one grid of initial values serve every sample.
+#
+# input:
+# settings	as returned by settings()
+# samples	list of arrays of wait times
+# starts	list of initial values (None where not given)
+# grid		initial values per step of the grid search
+#
+# output:
+# tau		array [samples,steps] of sorted decay times
+# value		array [samples] of costs
+#
+def fitgroup(settings,samples,starts,grid):
+
+    steps, order, weight, diag, bc = settings
+    n = gmm.ordermask(order,steps)
+    mask = n.astype(bool)
+    k, kcov = cu.cumulantsN(samples,n=n,jack=True,bc=bc)
+    mean = np.array([np.mean(sample) for sample in samples])
+    N = np.array([len(sample) for sample in samples])
+    powers = mean[:,None]**np.arange(1,7)[mask]
+    scale = powers[:,:,None]*powers[:,None,:]
+    k = k/powers
+
+    def weightmatrix(kcov):
+        if diag == True:
+            w = np.zeros(kcov.shape)
+            for i in range(kcov.shape[1]):
+                w[:,i,i] = 1.0/kcov[:,i,i]
+        else:
+            w = np.linalg.inv(kcov)
+        return w*scale
+
+    given = np.array([start is not None for start in starts])
+    tau = np.zeros([len(samples),steps])
+    if np.any(given):
+        tau[given] = np.array([start for start in starts if start is not None])/mean[given,None]
+
+    # weights found from the sample: jackknife or identity
+    if weight == 'iden':
+        w = np.tile(np.identity(mask.sum()),[len(samples),1,1])*scale
+    else:
+        w = weightmatrix(kcov)
+    search = ~given
+    if np.any(search):
+        tau[search] = gmm.gmmGN(k[search],w[search],fit.startlist(1.0,steps,grid),n)
+
+    # model weights are found at the initial values (or jackknife
+    # estimates) and the fit done again from them
+    if weight == 'analytic':
+        w = weightmatrix(cu.kcovanalyticN(tau*mean[:,None],N,n=n))
+        tau = gmm.gmmN(k,w,tau,n)
+    elif np.any(given):
+        tau[given] = gmm.gmmN(k[given],w[given],tau[given],n)
+    value = gmm.costN(tau,k,w,mask)
+
+    return tau*mean[:,None], value
+
+##############################################################
+#############   fitbatch()   ##########################
+##############################################################
+#
+def fitbatch(task):
+    """fit one batch in a worker, task is a tuple built by Server.
+    Returns a response (without latencies) for each sample and the
+    time taken.  If the batch fails as a whole (e.g. a singular
+    covariance matrix) its samples are fit one at a time, so only
+    the failing ones get an error."""
+
+    settings, samples, starts, grid = task
+    start = clock()
+    try:
+        tau, value = fitgroup(settings,samples,starts,grid)
+        rows = []
+        for i in range(len(samples)):
+            if np.all(np.isfinite(tau[i])) and np.isfinite(value[i]):
+                rows.append({'N':len(samples[i]),'tau':tau[i].tolist(),'cost':float(value[i])})
+            else:
+                rows.append({'N':len(samples[i]),'error':"fit did not converge to finite values"})
+    except Exception as error:
+        if len(samples) == 1:
+            rows = [{'N':len(samples[0]),'error':'%s: %s' % (type(error).__name__,error)}]
+        else:
+            rows = [fitbatch((settings,[samples[i]],[starts[i]],grid))[0][0] for i in range(len(samples))]
+
+    return rows, clock() - start
+
+##############################################################
+#############   Server   ##########################
+##############################################################
+#
+# the fitting service.  Requests enter a queue, from which collect()
+# takes one window at a time, groups it by settings and sends each
+# group to the pool.  The pool is a single worker thread when
+# workers=1, so the event loop is never held up by a fit, or else a
+# pool of worker processes (workers=None: all cores).
+#
+class Server(object):
+
+    def __init__(self,workers=1,window=Window,maxbatch=MaxBatch,grid=3):
+        self.workers = workers
+        self.window = window
+        self.maxbatch = maxbatch
+        self.grid = grid
+        self.queue = None
+        self.pool = None
+        self.collector = None
+        self.servers = []
+
+    def open(self):
+        """start the pool and the collecting task, done by the first
+        submit() if not called before"""
+        if self.collector is not None:
+            return
+        if self.workers == 1:
+            self.pool = concurrent.futures.ThreadPoolExecutor(1)
+        else:
+            # spawned, not forked: a forked worker would hold open the
+            # client connections of the moment it was started
+            context = multiprocessing.get_context('spawn')
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers,mp_context=context)
+        self.queue = asyncio.Queue()
+        self.collector = asyncio.ensure_future(self.collect())
+
+    async def submit(self,request):
+        """fit one request (a dictionary, see above) and return the
+        response dictionary"""
+        received = clock()
+        ident = request.get('id',None) if isinstance(request,dict) else None
+        try:
+            key, times, tau0 = settings(request)
+        except (ValueError,TypeError) as error:
+            return {'id':ident,'error':'%s: %s' % (type(error).__name__,error)}
+        self.open()
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((key,times,tau0,received,future))
+        response = await future
+        response['id'] = ident
+        response['latency']['total'] = clock() - received
+        return response
+
+    async def collect(self):
+        """take requests from the queue a window at a time and send
+        them to the pool, grouped by settings"""
+        while True:
+            batch = [await self.queue.get()]
+            deadline = clock() + self.window
+            while len(batch) < self.maxbatch:
+                remaining = deadline - clock()
+                if remaining <= 0.0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),remaining))
+                except asyncio.TimeoutError:
+                    break
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[0],[]).append(item)
+            for key in groups:
+                asyncio.ensure_future(self.dispatch(key,groups[key]))
+
+    async def dispatch(self,key,group):
+        """fit one group in the pool and answer its requests"""
+        sent = clock()
+        task = (key,[item[1] for item in group],[item[2] for item in group],self.grid)
+        try:
+            rows, seconds = await asyncio.get_event_loop().run_in_executor(self.pool,fitbatch,task)
+        except Exception as error:	# e.g. a worker process died
+            rows, seconds = [{'error':'%s: %s' % (type(error).__name__,error)}]*len(group), clock() - sent
+        for item, row in zip(group,rows):
+            if not item[4].done():
+                row = dict(row)
+                row['batch'] = len(group)
+                row['latency'] = {'queued':sent - item[3],'fit':seconds}
+                item[4].set_result(row)
+
+    async def handle(self,reader,writer):
+        """answer the requests of one connection, each as soon as it
+        is fit"""
+        pending = set()
+
+        async def answer(line):
+            try:
+                request = json.loads(line)
+            except ValueError as error:
+                response = {'id':None,'error':'ValueError: %s' % error}
+            else:
+                response = await self.submit(request)
+            try:
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+            except ConnectionError:	# the client has gone
+                pass
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(answer(line.decode()))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        except (ConnectionError,ValueError):	# client gone, or a line over LineLimit
+            pass
+        finally:
+            writer.close()
+
+    async def start(self,address):
+        """listen on address: a Unix socket path, or a TCP port (or
+        'host:port') on localhost"""
+        self.open()
+        if self.workers != 1:	# start every worker process now, not on the first request
+            loop = asyncio.get_event_loop()
+            warmup = ((1,1,'jack',False,True),[np.arange(1.0,11.0)],[None],self.grid)
+            await asyncio.gather(*[loop.run_in_executor(self.pool,fitbatch,warmup)
+                                   for i in range(self.workers or os.cpu_count())])
+        path, host, port = parseaddress(address)
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle,path=path,limit=LineLimit)
+        else:
+            server = await asyncio.start_server(self.handle,host=host,port=port,limit=LineLimit)
+        self.servers.append(server)
+        return server
+
+    async def serve(self,address):
+        """listen on address until cancelled"""
+        server = await self.start(address)
+        try:
+            await server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """stop listening, the collecting task and the pool"""
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+        if self.collector is not None:
+            self.collector.cancel()
+            self.collector = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+##############################################################
+#############   parseaddress()   ##########################
+##############################################################
+#
+# an address is a Unix socket path, a port number, or 'host:port'
+#
+# output:
+# path, host, port	path is None for TCP, host and port None for
+#			a Unix socket
+#
+def parseaddress(address):
+
+    if isinstance(address,int):
+        return None, '127.0.0.1', address
+    if isinstance(address,(tuple,list)):
+        return None, address[0], int(address[1])
+    address = str(address)
+    if address.isdigit():
+        return None, '127.0.0.1', int(address)
+    if ':' in address and '/' not in address:
+        host, port = address.rsplit(':',1)
+        return None, host or '127.0.0.1', int(port)
+
+    return address, None, None
+
+##############################################################
+#############   request()   #####################################
+##############################################################
+#
+def request(address,requests,timeout=None):
+    """blocking client: send requests to a server and wait for all
+    the responses.
+
+    input:
+    address     Unix socket path, port on localhost, or 'host:port'
+    requests    list of request dictionaries (see serve.py).  Those
+                without an 'id' are given their index in the list
+    timeout     seconds to wait for the responses (default: no limit)
+    output:
+    responses   list of response dictionaries, in the order of
+                requests"""
+
+    requests = [dict(r) for r in requests]
+    for i in range(len(requests)):
+        requests[i].setdefault('id',i)
+    path, host, port = parseaddress(address)
+    if path is not None:
+        connection = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        connection.connect(path)
+    else:
+        connection = socket.create_connection((host,port),timeout)
+
+    with connection:
+        lines = ''.join([json.dumps(r) + '\n' for r in requests])
+        connection.sendall(lines.encode())
+        connection.shutdown(socket.SHUT_WR)
+        received = connection.makefile('r')
+        answers = [json.loads(line) for line in received if line.strip()]
+
+    # match responses to requests by id
+    byid = {}
+    for answer in answers:
+        byid.setdefault(json.dumps(answer.get('id')),[]).append(answer)
+
+    return [byid[json.dumps(r['id'])].pop(0) for r in requests]
+
+##############################################################
+#############   main()   #####################################
+##############################################################
+#
+def main(argv=None):
+    """command line entry point, see python serve.py --help"""
+
+    parser = argparse.ArgumentParser(description="serve GMM fits of dwell time samples on this machine")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--socket',default=None,help="Unix socket path to listen on")
+    where.add_argument('--port',type=int,default=None,help="TCP port to listen on (localhost)")
+    parser.add_argument('--host',default='127.0.0.1',help="host for --port (default 127.0.0.1)")
+    parser.add_argument('--workers',type=int,default=1,help="worker processes, 0 for all cores (default 1: one thread)")
+    parser.add_argument('--window',type=float,default=Window,help="seconds requests are collected before a batch (default %g)" % Window)
+    parser.add_argument('--maxbatch',type=int,default=MaxBatch,help="most requests in a batch (default %d)" % MaxBatch)
+    parser.add_argument('--grid',type=int,default=3,help="initial values per step of the grid search (default 3)")
+    args = parser.parse_args(argv)
+
+    address = args.socket if args.socket is not None else (args.host,args.port)
+    server = Server(workers=args.workers or None,window=args.window,maxbatch=args.maxbatch,grid=args.grid)
+    print("serving on",address,file=sys.stderr)
+    try:
+        asyncio.run(server.serve(address))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
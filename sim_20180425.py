@@ -5,11 +5,105 @@
 # dwell time distributions that represent single molecule
 # reactions.  
 #
+# random numbers come from numpy Generator objects (numpy 1.17
+# or later).  Every function takes an optional seed, which may be
+# an integer, a np.random.SeedSequence or a np.random.Generator.
+# When no seed is given a module level generator is used, so the
+# global state of the random module is never touched.
+#
 ########################################################
 #########################################################
 
 import numpy as np
-import random as rd
+import os
+
+############################################################
+############# define global variable
+##################################################
+
+DefaultGenerator = np.random.default_rng()
+
+# a forked process (e.g. a multiprocessing pool worker) would inherit
+# the state of the module generator and repeat the draws of its
+# parent and siblings, so it gets a fresh one
+def reseed():
+    "reseed(): replaces the module generator with a freshly seeded one"
+
+    global DefaultGenerator
+    DefaultGenerator = np.random.default_rng()
+
+if hasattr(os,'register_at_fork'):	# python 3.7 and later
+    os.register_at_fork(after_in_child=reseed)
+
+############################################################
+############################################################
+# generator(seed):
+# returns a numpy random Generator for the seed supplied
+#
+# input:
+# seed	None, integer, SeedSequence or Generator
+#
+# output:
+# rng	np.random.Generator, the module generator if seed=None
+#
+def generator(seed=None):
+    "generator(seed): returns a numpy Generator for seed (None gives module generator)"
+
+    if seed is None:
+        return DefaultGenerator
+
+    return np.random.default_rng(seed)
+
+############################################################
+############################################################
+# streams(seed,count):
+# returns independent random streams for parallel workers
+#
+# input:
+# seed	integer or SeedSequence that fixes all of the streams
+# count	number of streams
+#
+# output:
+# list of count SeedSequence objects, each may be passed as
+# the seed of any function here.  The same seed always gives
+# the same streams, regardless of how they are shared out.
+#
+def streams(seed,count):
+    "streams(seed,count): returns count independent SeedSequence streams from seed"
+
+    if not isinstance(seed,np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    return seed.spawn(count)
+
+############################################################
+############################################################
+# multi_poissonBlock(tau,N,trials):
+# returns trials X N sample wait times for n step process
+# 
+#   1    2     3
+# A -> B -> C - > ...
+#
+# the whole (trials X N X steps) block of exponential step 
+# times is drawn at once and summed along the step axis
+#
+# input:
+# tau		[tau1, tau2, ...]
+# N 		number of samples in each trial
+# trials	number of trials (default 1)
+# seed		None, integer, SeedSequence or Generator (default None)
+#
+# output:
+# wait_time = array [trials,N] of sample wait times
+#
+def multi_poissonBlock(tau,N,trials=1,seed=None):
+    "multi_poissonBlock([tau1,tau2,...],N,trials): returns trials X N samples from an n step process"
+
+    tau = np.array(tau,dtype=float).reshape(-1)
+    rng = generator(seed)
+    block = rng.standard_exponential([trials,N,len(tau)])
+
+    return np.dot(block,tau)
 
 ############################################################
 ############################################################
@@ -24,19 +118,15 @@ import random as rd
 #
 # input:
 # tau = [tau1, tau2, ...]
+# seed = None, integer, SeedSequence or Generator (default None)
 #
 # output:
 # wait_time = sample wait time
 # 
-def multi_poisson(tau):
+def multi_poisson(tau,seed=None):
     "multi_poisson([tau1,tau2...]): returns a sample from an n step process with mean wait times [tau1,tau2,...]"
     
-    tau = np.array(tau)
-    wait_time = 0.0
-    for t in tau:
-        wait_time = wait_time - np.log(1.0-rd.random())*t
-     
-    return wait_time
+    return multi_poissonBlock(tau,1,seed=seed)[0,0]
 
 ############################################################
 ############################################################
@@ -52,22 +142,140 @@ def multi_poisson(tau):
 # input:
 # tau	[tau1, tau2, ...]
 # N 	number of samples
+# seed	None, integer, SeedSequence or Generator (default None)
 #
 # output:
 # wait_time = array of N samples wait time
 #
-def multi_poissonN(tau,N):
+def multi_poissonN(tau,N,seed=None):
     "multi_poissonN([tau1,tau2,...],N): returns N samples from an n step process with mean wait times tau1 and tau2"
   
-    tau = np.array(tau)
-    wait_time = np.zeros(N)
-    for j in range(N):
-        for t in tau:
-            wait_time[j] = wait_time[j] - np.log(1.0-rd.random())*t
-    
-    return wait_time
+    return multi_poissonBlock(tau,N,seed=seed)[0]
 
+############################################################
+############################################################
+# sequential(tau):
+# returns the rate matrix of the n step irreversible process
+#
+#   1    2     3
+# A -> B -> C - > ...
+#
+# for use with gillespieBlock(), e.g. to check it against
+# multi_poissonBlock()
+#
+# input:
+# tau	[tau1, tau2, ...]
+#
+# output:
+# rates	array [steps+1,steps+1], rates[i,i+1] = 1/tau[i]
+#
+def sequential(tau):
+    "sequential([tau1,tau2,...]): returns the rate matrix of an n step irreversible process"
 
+    tau = np.array(tau,dtype=float).reshape(-1)
+    rates = np.zeros([len(tau)+1,len(tau)+1])
+    rates[np.arange(len(tau)),np.arange(1,len(tau)+1)] = 1.0/tau
 
+    return rates
 
+############################################################
+############################################################
+# gillespieBlock(rates,N,trials):
+# returns trials X N first passage times of a kinetic scheme
+# given by a rate matrix, which may have reversible steps and
+# branches, e.g.
+#
+#      k01       k12           k01 0  0
+#   A <---> B ---> C   rates = k10 0 k12
+#      k10                      0  0  0
+#
+# every trajectory of the block is advanced together by the
+# Gillespie algorithm: each round draws an exponential time with
+# the total exit rate of the current state of every trajectory
+# still running, and the next state with probability in
+# proportion to its rate.  Trajectories stop on reaching a final
+# state, so the number of rounds is set by the longest one.
+#
+# input:
+# rates		array [states,states], rates[i,j] is the rate of i -> j
+#		(the diagonal is ignored)
+# N		number of samples in each trial
+# trials	number of trials (default 1)
+# start		initial state, or array [states] of probabilities of
+#		the initial state (default 0)
+# final		list of final states (default: the states with no exit)
+# seed		None, integer, SeedSequence or Generator (default None)
+#
+# output:
+# wait_time = array [trials,N] of times from start to first 
+#	reaching a final state
+#
+def gillespieBlock(rates,N,trials=1,start=0,final=None,seed=None):
+    "gillespieBlock(rates,N,trials): returns trials X N first passage times of the scheme with rate matrix rates"
+
+    rates = np.array(rates,dtype=float)
+    states = len(rates)
+    if rates.shape != (states,states) or np.any(rates < 0.0):
+        raise ValueError("rates must be a square matrix of rates >= 0")
+    rates[np.arange(states),np.arange(states)] = 0.0
+    outflow = rates.sum(axis=1)
+    isfinal = np.zeros(states,dtype=bool)
+    if final is None:
+        isfinal[outflow == 0.0] = True
+    else:
+        isfinal[final] = True
+    rng = generator(seed)
+
+    # initial states, and every state reachable from them must be
+    # able to reach a final state
+    if np.ndim(start) == 0:
+        state = np.full(trials*N,int(start))
+        reached = np.zeros(states,dtype=bool)
+        reached[int(start)] = True
+    else:
+        probability = np.array(start,dtype=float)
+        state = rng.choice(states,size=trials*N,p=probability/probability.sum())
+        reached = probability > 0.0
+    step = (rates > 0.0) & ~isfinal[:,None]
+    for i in range(states):
+        reached = reached | step[reached].any(axis=0)
+    ends = isfinal.copy()
+    for i in range(states):
+        ends = ends | (step & ends[None,:]).any(axis=1)
+    if not np.all(ends[reached]):
+        raise ValueError("states %s can be reached but can not reach a final state" % 
+                         np.nonzero(reached & ~ends)[0].tolist())
+
+    # cumulative rates of each row, for choosing the next state
+    cumulative = np.cumsum(rates,axis=1)
+    wait_time = np.zeros(trials*N)
+    live = np.nonzero(~isfinal[state])[0]
+    state = state[live]
+    while len(live) > 0:
+        total = outflow[state]
+        wait_time[live] += rng.standard_exponential(len(live))/total
+        threshold = rng.random(len(live))*total
+        state = (cumulative[state] <= threshold[:,None]).sum(axis=1)
+        running = ~isfinal[state]
+        live, state = live[running], state[running]
+
+    return wait_time.reshape(trials,N)
+
+############################################################
+############################################################
+# gillespieN(rates,N):
+# returns N first passage times of a kinetic scheme given by a
+# rate matrix, see gillespieBlock()
+#
+# input:
+# rates	array [states,states], rates[i,j] is the rate of i -> j
+# N	number of samples
+# start, final, seed	see gillespieBlock()
+#
+# output:
+# wait_time = array of N first passage times
+#
+def gillespieN(rates,N,start=0,final=None,seed=None):
+    "gillespieN(rates,N): returns N first passage times of the scheme with rate matrix rates"
 
+    return gillespieBlock(rates,N,start=start,final=final,seed=seed)[0]
@@ -0,0 +1,477 @@
+############################################################
+############################################################
+#############   sweep.py   ##########################
+##############################################################
+############################################################
+#
+# Parameter sweep module v20261017
+#
+# Runs the simulations of the genData scripts (tau X N X order
+# X trials) on a pool of worker processes.  Each (tau,N,order)
+# cell is split into chunks of trials, and every chunk draws from
+# its own random stream spawned from a single seed, so results
+# do not depend on the number of workers.  Trials are fit with
+# gmm.gmmG and gmm.gmm as in the published scripts, or (fits with
+# 'solver':'newton') all trials of a chunk together with the
+# batched functions cumulant.cumulantsN and gmm.gmmGN.  Finished
+# cells can be saved to a store directory so that an interrupted
+# sweep can be restarted.
+#
+############################################################
+############################################################
+
+from __future__ import print_function
+import numpy as np
+import multiprocessing
+import json
+import os
+import sim
+import cumulant as cu
+import gmm
+
+STATS = ['mean','meandev','std','se']	# as returned by cumulant.stats()
+STEPS = 'ABCDEF'			# names of decay times, smallest first
+PassTol = 1e-6			# convergence of iterated GMM fits
+
+##############################################################
+#############   fitsamples()   ##########################
+##############################################################
+#
+# fit every sample of a batch with each of a list of fits.
+#
+# input:
+# samples	2D array [trials,N] of wait times
+# order		order of method used by fits that do not give their own
+# taulist	list of initial values for global search (see gmm.gmmG)
+# fits		list of dictionaries, one per fit, with keys
+#		  'name'   suffix of result arrays, e.g. 'd' for meanAd
+#		  'diag'   use diagonal covariance matrix (default False)
+#		  'weight' 'jack', 'iden', 'int', 'analytic' (orders up
+#		           to 4) or 'mc' (default 'jack')
+#		  'n'      order of this fit (default order)
+#		  'start'  index of an earlier fit in the list.  If given
+#		           the fit starts from that fit's estimates (as
+#		           gmm.gmm), otherwise it searches taulist (as
+#		           gmm.gmmG).  Required for 'int', 'analytic'
+#		           and 'mc'
+#		  'passes' for 'int', 'analytic' and 'mc', the most fits
+#		           of iterated GMM (default 1).  Each pass finds
+#		           the weight at the last estimates and fits from
+#		           them, until no estimate changes by more than
+#		           PassTol (relative)
+#		  'solver' 'bfgs' (default): each trial is fit on its own
+#		           with gmm.gmmG or gmm.gmm, as in the published
+#		           genData scripts.  'newton': all trials are fit
+#		           together with gmm.gmmGN or gmm.gmmN, which is
+#		           much faster but not the same minimizer
+# bc		use bias corrected cumulants (default True)
+# table		cumulant.CovarianceTable for 'int' fits (default: the
+#		one set by cumulant.initialize())
+# seed		None, integer or SeedSequence from which the 'mc'
+#		simulations of each trial get their own stream (see
+#		trialseeds(), default None: unseeded)
+#
+# output:
+# estimates	array [fits,trials,steps] of sorted decay times
+#
+def fitsamples(samples,order,taulist,fits,bc=True,table=None,seed=None):
+
+    samples = np.array(samples,dtype=float)
+    trials, N = samples.shape
+    taulist = np.array(taulist,dtype=float)
+    numparams = taulist.shape[1]
+    estimates = np.zeros([len(fits),trials,numparams])
+
+    # for the batched fits, all six cumulants (and jackknife
+    # covariances) are found once and every fit selects the orders
+    # it uses
+    batched = [fit for fit in fits if fit.get('solver','bfgs') != 'bfgs']
+    jack = any([fit.get('weight','jack')=='jack' for fit in batched])
+    if jack == True:
+        k6, kcov6 = cu.cumulantsN(samples,n=6,jack=True,bc=bc)
+    elif len(batched) > 0:
+        k6 = cu.cumulantsN(samples,n=6,jack=False,bc=bc)
+
+    moments = None
+    seeds = trialseeds(seed,trials)
+    for f in range(len(fits)):
+        fit = fits[f]
+        weight = fit.get('weight','jack')
+        n = gmm.ordermask(fit.get('n',order),numparams)
+        mask = n.astype(bool)
+        if 'start' in fit:
+            tau0 = estimates[fit['start']]
+        elif weight in ['int','analytic','mc']:
+            raise ValueError("fits with weight '%s' need a 'start' fit" % weight)
+
+        # one trial at a time with BFGS
+        if fit.get('solver','bfgs') == 'bfgs':
+            if moments is None:
+                moments = [cu.SampleMoments(sample,bc=bc) for sample in samples]
+            passes = fit.get('passes',1) if weight in ['int','analytic','mc'] else 1
+            update = 'iterate' if passes > 1 else None
+            for t in range(trials):
+                if 'start' in fit:
+                    estimates[f,t] = gmm.gmm(moments[t],tau0[t],n=n,diag=fit.get('diag',False),weight=weight,
+                                             table=table,update=update,maxpasses=passes,passtol=PassTol,
+                                             seed=seeds[t])
+                else:
+                    estimates[f,t] = gmm.gmmG(moments[t],taulist,n=n,diag=fit.get('diag',False),weight=weight,
+                                              table=table)
+            continue
+        elif fit['solver'] != 'newton':
+            raise ValueError("unknown solver '%s'" % fit['solver'])
+
+        # iterated GMM: model weights are found again at the last
+        # estimates and the fit repeated from them
+        k = k6[:,mask]
+        passes = fit.get('passes',1) if weight in ['int','analytic','mc'] else 1
+        for fitpass in range(passes):
+            if weight=='jack':
+                kcov = kcov6[:,mask][:,:,mask]
+            elif weight=='iden':
+                kcov = np.tile(np.identity(mask.sum()),[trials,1,1])
+            elif weight=='int':
+                kcov = cu.kcovintN(tau0,N,n=n,table=table)
+            elif weight=='analytic':
+                kcov = cu.kcovanalyticN(tau0,N,n=n)
+            elif weight=='mc':
+                kcov = np.array([cu.kcov(t0,N,trials=500,n=n,seed=s) for t0, s in zip(tau0,seeds)])
+            else:
+                raise ValueError("unknown weight '%s'" % weight)
+
+            if fit.get('diag',False)==True:
+                w = np.zeros(kcov.shape)
+                for i in range(kcov.shape[1]):
+                    w[:,i,i] = 1.0/kcov[:,i,i]
+            else:
+                w = np.linalg.inv(kcov)
+
+            if 'start' in fit:
+                estimates[f] = gmm.gmmN(k,w,tau0,n)
+                if np.all(np.abs(estimates[f]-tau0) <= PassTol*np.abs(tau0)):
+                    break
+                tau0 = estimates[f].copy()
+            else:
+                estimates[f] = gmm.gmmGN(k,w,taulist,n)
+
+    return estimates
+
+##############################################################
+#############   fitcell()   ##########################
+##############################################################
+#
+# simulate and fit the trials of one (tau,N,order) cell
+#
+# input:
+# tau		[tau1, tau2, ...] used in simulation
+# N		sample size
+# order		order of method
+# trials	number of trials
+# taulist, fits, bc, table	see fitsamples()
+# seed		None, integer, SeedSequence or Generator
+#
+# output:
+# estimates	array [fits,trials,steps] of sorted decay times
+#
+def fitcell(tau,N,order,trials,taulist,fits,seed=None,bc=True,table=None):
+
+    samples = sim.multi_poissonBlock(tau,N,trials,seed=seed)
+    if isinstance(seed,np.random.Generator):
+        seed = int(seed.integers(2**62))
+
+    return fitsamples(samples,order,taulist,fits,bc=bc,table=table,seed=seed)
+
+##############################################################
+#############   trialseeds()   ##########################
+##############################################################
+#
+# a random stream for the 'mc' weights of each trial, spawned from
+# a copy of seed, so the streams depend only on seed (and not on
+# what was spawned from it before), and so on the chunk of trials
+# and not on the worker that fits it
+#
+# input:
+# seed		None, integer or SeedSequence
+# trials	number of trials
+#
+# output:
+# list of trials SeedSequence objects (or None if seed is None)
+#
+def trialseeds(seed,trials):
+
+    if seed is None:
+        return [None]*trials
+    if not isinstance(seed,np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seed = np.random.SeedSequence(seed.entropy,spawn_key=seed.spawn_key)
+
+    return seed.spawn(trials)
+
+##############################################################
+#############   pool workers  ##########################
+##############################################################
+#
+def fitchunk(task):
+    """fit one chunk of trials, task is a tuple built by run()"""
+
+    cell, chunk, tau, N, order, trials, taulist, fits, bc, table, seed = task
+
+    return cell, chunk, fitcell(tau,N,order,trials,taulist,fits,seed=seed,bc=bc,table=table)
+
+##############################################################
+#############   tasks()   ##########################
+##############################################################
+#
+# split a sweep into chunks of trials with their random streams
+#
+# input:
+# cells		list of (tau,N,order) tuples
+# trials	number of trials per cell
+# chunk		number of trials per chunk
+# seed		integer or SeedSequence fixing all random streams
+#
+# output:
+# list of (cell index, chunk index, trials in chunk, SeedSequence)
+#
+def tasks(cells,trials,chunk,seed):
+
+    chunks = []
+    cellstreams = sim.streams(seed,len(cells))
+    numchunks = int(np.ceil(float(trials)/chunk))
+    for c in range(len(cells)):
+        chunkstreams = cellstreams[c].spawn(numchunks)
+        for m in range(numchunks):
+            chunks.append( (c,m,min(chunk,trials-m*chunk),chunkstreams[m]) )
+
+    return chunks
+
+##############################################################
+#############   result store   ##########################
+##############################################################
+#
+# a sweep may keep its results in a store directory, so that an
+# interrupted sweep can be restarted.  The directory holds
+#   manifest.json	the sweep parameters and list of cells
+#   cell_NNNNN.npz	one file per finished cell, with the raw
+#			estimates [fits,trials,steps] of every trial
+# Cell files are written to a temporary name and renamed, so a
+# cell file is either complete or absent.
+#
+def manifest(taus,N,orders,trials,taulist,fits,seed,chunk,bc,table=None):
+    """sweep description saved in manifest.json of a store.  For
+    sweeps with 'int' fits it records the covariance table (its
+    path, size and modification time), so a store is not resumed
+    with a different table"""
+
+    if not isinstance(seed,np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    cells = [ {'tau':list(taus[i]),'N':N[j],'order':orders[k]}
+              for i in range(len(taus)) for j in range(len(N)) for k in range(len(orders)) ]
+    source = None
+    if table is not None and any([fit.get('weight','jack')=='int' for fit in fits]):
+        filename = table.filename
+        if os.path.isdir(filename):
+            status = os.stat(os.path.join(filename,'manifest.json'))
+        else:
+            status = os.stat(filename)
+        source = [os.path.abspath(filename),int(status.st_size),int(status.st_mtime_ns)]
+    description = {'version':2,'taus':taus,'N':N,'orders':orders,'trials':trials,
+                   'taulist':taulist,'fits':fits,'entropy':seed.entropy,
+                   'spawn_key':list(seed.spawn_key),'chunk':chunk,'bc':bc,'cells':cells,
+                   'table':source}
+
+    # round trip through json so that it compares equal to a loaded
+    # manifest, numpy arrays and numbers become lists and numbers
+    plain = lambda x: x.tolist() if hasattr(x,'tolist') else float(x)
+    return json.loads(json.dumps(description,default=plain))
+
+def openstore(store,description):
+    """create store directory, or check an existing one matches"""
+
+    filename = os.path.join(store,'manifest.json')
+    if not os.path.isdir(store):
+        os.makedirs(store)
+    if os.path.exists(filename):
+        with open(filename) as infile:
+            saved = json.load(infile)
+        if saved != description:
+            raise ValueError("store %s holds a different sweep" % store)
+    else:
+        writeatomic(filename,lambda outfile: outfile.write(json.dumps(description,indent=1).encode()))
+
+def cellfile(store,c):
+    """name of the file holding cell c of a store"""
+
+    return os.path.join(store,'cell_%05d.npz' % c)
+
+def writeatomic(filename,write):
+    """write a file with write(fileobject), then rename into place"""
+
+    temporary = filename + '.tmp%d' % os.getpid()
+    with open(temporary,'wb') as outfile:
+        write(outfile)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temporary,filename)
+
+def savecell(store,c,cell,estimates):
+    """save raw estimates of a finished cell"""
+
+    writeatomic(cellfile(store,c),
+                lambda outfile: np.savez(outfile,estimates=estimates,tau=cell['tau'],N=cell['N'],order=cell['order']))
+
+def loadcell(store,c):
+    """raw estimates of cell c, or None if it is not finished"""
+
+    if not os.path.exists(cellfile(store,c)):
+        return None
+    with np.load(cellfile(store,c)) as data:
+        return data['estimates']
+
+##############################################################
+#############   load()   ##########################
+##############################################################
+#
+# read the results of a (possibly unfinished) sweep from a store
+#
+# input:
+# store		directory of the sweep
+#
+# output:
+# results	dictionary of statistics arrays as returned by run(),
+#		unfinished cells are nan
+# estimates	list of raw estimates [fits,trials,steps] of each cell
+#		(in the order of the manifest), None if unfinished
+#
+def load(store):
+
+    with open(os.path.join(store,'manifest.json')) as infile:
+        description = json.load(infile)
+    shape = [len(description['taus']),len(description['N']),len(description['orders'])]
+    results = emptyresults(description['fits'],len(description['taulist'][0]),shape)
+    estimates = []
+    for c in range(len(description['cells'])):
+        estimates.append(loadcell(store,c))
+        if estimates[c] is not None:
+            cellstats(results,np.unravel_index(c,shape),estimates[c],description['fits'])
+
+    return results, estimates
+
+##############################################################
+#############   statistics of cells   ##########################
+##############################################################
+#
+def emptyresults(fits,numparams,shape):
+    """dictionary of nan arrays to hold statistics"""
+
+    results = {}
+    for fit in fits:
+        for s in range(numparams):
+            for stat in STATS:
+                results[stat+STEPS[s]+fit['name']] = np.full(shape,np.nan)
+
+    return results
+
+def cellstats(results,index,estimates,fits):
+    """fill in statistics of the estimates [fits,trials,steps] of a cell"""
+
+    for f in range(len(fits)):
+        for s in range(estimates.shape[2]):
+            values = cu.stats(estimates[f,:,s])
+            for v in range(len(STATS)):
+                results[STATS[v]+STEPS[s]+fits[f]['name']][tuple(index)] = values[v]
+
+##############################################################
+#############   run()   #####################################
+##############################################################
+#
+def run(taus,N,orders,trials,taulist,fits,seed=0,workers=None,chunk=100,
+        bc=True,table=None,store=None,verbose=True):
+    """runs a genData sweep over the grid taus X N X orders on a
+    pool of worker processes and returns the statistics of the
+    estimates.
+
+    input:
+    taus        list of decay times used in simulation, e.g.
+                [[10.0,10.0],[10.0,20.0]]
+    N           list of sample sizes
+    orders      list of orders of method
+    trials      number of trials for each (tau,N,order) cell
+    taulist     list of initial values for global search
+    fits        list of fits done on every trial, see fitsamples()
+    seed        integer or SeedSequence for the random streams.  The
+                same seed (and chunk) gives the same results for
+                any number of workers
+    workers     number of worker processes (default: all cores),
+                1 runs in this process
+    chunk       number of trials per task (default 100)
+    bc          use bias corrected cumulants (default True)
+    table       cumulant.CovarianceTable (or its file name) used by
+                fits with weight='int'.  Workers map the table file
+                themselves (default: cumulant.initialize() table)
+    store       directory in which each finished cell is saved (see
+                load()).  A sweep restarted with the same store and
+                parameters skips the cells already finished
+    verbose     print each cell as it finishes
+    output:
+    results     dictionary of arrays [len(taus),len(N),len(orders)]
+                named as in the genData scripts, e.g. results['meanAd'],
+                results['seBf'] are the mean of tauA and standard
+                error of tauB for fits named 'd' and 'f'.  Cells
+                that are not finished are nan"""
+
+    cells = [(i,j,k) for i in range(len(taus)) for j in range(len(N)) for k in range(len(orders))]
+    numparams = len(taulist[0])
+    shape = [len(taus),len(N),len(orders)]
+    results = emptyresults(fits,numparams,shape)
+
+    if table is None:
+        table = cu.DefaultTable
+    elif not isinstance(table,cu.CovarianceTable):
+        table = cu.CovarianceTable(table)
+
+    # cells already finished in the store are not run again
+    done = set()
+    if store is not None:
+        description = manifest(taus,N,orders,trials,taulist,fits,seed,chunk,bc,table)
+        openstore(store,description)
+        for c in range(len(cells)):
+            estimates = loadcell(store,c)
+            if estimates is not None:
+                cellstats(results,cells[c],estimates,fits)
+                done.add(c)
+        if verbose == True and len(done) > 0:
+            print("found",len(done),"of",len(cells),"cells in",store)
+
+    chunks = tasks(cells,trials,chunk,seed)
+    jobs = [ (c,m,taus[cells[c][0]],N[cells[c][1]],orders[cells[c][2]],size,taulist,fits,bc,table,stream)
+             for c, m, size, stream in chunks if c not in done ]
+    if len(jobs) == 0:
+        return results
+
+    # collect chunks as they finish
+    pieces = [{} for cell in cells]
+    numchunks = len(chunks)//len(cells)
+
+    def collect(finished):
+        for c, m, estimates in finished:
+            pieces[c][m] = estimates
+            if len(pieces[c]) < numchunks:
+                continue
+            estimates = np.concatenate([pieces[c][m] for m in range(numchunks)],axis=1)
+            pieces[c] = None
+            if store is not None:
+                savecell(store,c,description['cells'][c],estimates)
+            cellstats(results,cells[c],estimates,fits)
+            i, j, k = cells[c]
+            if verbose == True:
+                print("finished tau =",taus[i],"N =",N[j],"order =",orders[k])
+
+    if workers == 1:
+        collect(map(fitchunk,jobs))
+    else:
+        with multiprocessing.Pool(workers) as pool:	# closed even if a worker fails
+            collect(pool.imap_unordered(fitchunk,jobs))
+
+    return results
@@ -0,0 +1,190 @@
+############################################################
+############################################################
+#############   table.py   ##########################
+##############################################################
+############################################################
+#
+# Covariance table module v20261017
+#
+# Builds the table of cumulant covariances (the "grand matrix")
+# used by cumulant.kcovint(), for any list of sample sizes N and
+# any grid of ratios tau2/tau1.  Each point of the table is the
+# monte-carlo covariance cumulant.kcov([1,ratio],N), computed on a
+# pool of worker processes.  Tables are kept in a directory (see
+# cumulant.readtable()) and can be extended: points already in the
+# table are not computed again.
+#
+# example:
+# table.build('grandmatrix.table',[5,10,20,50,100,200,500,1000],
+#             table.ratiogrid(1.0,1000.0,60,log=True))
+# cu.kcovint(tau,N,table=cu.CovarianceTable('grandmatrix.table'))
+#
+############################################################
+############################################################
+
+from __future__ import print_function
+import numpy as np
+import multiprocessing
+import json
+import os
+import cumulant as cu
+
+##############################################################
+#############   ratiogrid()   ##########################
+##############################################################
+#
+# returns a grid of ratios tau2/tau1
+#
+# input:
+# low, high	first and last ratio (low >= 1)
+# num		number of ratios
+# log		space ratios logarithmically? (default False)
+#
+# output:
+# array of num ratios
+#
+def ratiogrid(low,high,num,log=False):
+
+    if log==True:
+        return np.geomspace(low,high,num)
+    else:
+        return np.linspace(low,high,num)
+
+##############################################################
+#############   pointseed()   ##########################
+##############################################################
+#
+# random stream of one table point.  It depends only on the table
+# seed, N and ratio, so points do not change when others are added
+#
+def pointseed(seed,N,ratio):
+
+    bits = int(np.array(ratio,dtype=np.float64).view(np.uint64))
+
+    return np.random.SeedSequence([int(seed),int(N),bits])
+
+def covpoint(task):
+    """covariance of one table point, task is a tuple built by build()"""
+
+    i, j, N, ratio, trials, seed = task
+    covariance = cu.kcov([1.0,ratio],N,trials=trials,seed=pointseed(seed,N,ratio),tol=None,cache=False)
+
+    return i, j, covariance
+
+##############################################################
+#############   write()   ##########################
+##############################################################
+#
+# write a covariance table directory.  Each file is written to a
+# temporary name and renamed, the manifest last.
+#
+# input:
+# path		table directory
+# NumSamples	list of N
+# TauTwo	list of ratios
+# GrandMatrix	array [N,ratio,4,4]
+# trials	number of monte-carlo trials of each point
+# seed		seed of the table
+#
+def write(path,NumSamples,TauTwo,GrandMatrix,trials,seed):
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    arrays = {'NumSamples':np.array(NumSamples,dtype=int),
+              'TauTwo':np.array(TauTwo,dtype=float),
+              'GrandMatrix':np.array(GrandMatrix,dtype=float)}
+    for name in arrays:
+        temporary = os.path.join(path,name+'.npy.tmp')
+        with open(temporary,'wb') as outfile:
+            np.save(outfile,arrays[name])
+        os.replace(temporary,os.path.join(path,name+'.npy'))
+
+    manifest = {'version':cu.TableVersion,'trials':trials,'seed':seed,
+                'shape':list(arrays['GrandMatrix'].shape),
+                'missing':int(np.isnan(arrays['GrandMatrix'][:,:,0,0]).sum())}
+    temporary = os.path.join(path,'manifest.json.tmp')
+    with open(temporary,'w') as outfile:
+        json.dump(manifest,outfile,indent=1)
+    os.replace(temporary,os.path.join(path,'manifest.json'))
+
+##############################################################
+#############   convert()   ##########################
+##############################################################
+#
+# convert a pickled grand matrix (e.g. grandmatrix.pkl) into a
+# table directory.  The number of trials and seed used to make it
+# are unknown, so such a table can not be extended by build()
+#
+def convert(filename,path):
+
+    old = cu.CovarianceTable(filename)
+    write(path,old.NumSamples,old.TauTwo,old.GrandMatrix,None,None)
+
+##############################################################
+#############   build()   #####################################
+##############################################################
+#
+def build(path,N,ratios,trials=10000,seed=0,workers=None,checkpoint=100,verbose=True):
+    """build or extend a covariance table on a pool of worker
+    processes.
+
+    input:
+    path        table directory.  If it exists, its grid is merged
+                with N and ratios and only missing points are computed
+    N           list of sample sizes
+    ratios      list of ratios tau2/tau1 (>= 1), see ratiogrid()
+    trials      monte-carlo trials for each point (default 10000),
+                must agree with an existing table
+    seed        integer seed of the table, must agree with an
+                existing table
+    workers     number of worker processes (default: all cores),
+                1 runs in this process
+    checkpoint  the table is written after every checkpoint points,
+                so an interrupted build can be continued
+    verbose     print progress
+    output:
+    table       dictionary as returned by cumulant.readtable()"""
+
+#   merge requested grid with existing table
+    NumSamples = np.array(N,dtype=int)
+    TauTwo = np.array(ratios,dtype=float)
+    if os.path.exists(os.path.join(path,'manifest.json')):
+        old = cu.readtable(path)
+        if old['trials'] != trials or old['seed'] != seed:
+            raise ValueError("table %s was made with trials=%s, seed=%s" % (path,old['trials'],old['seed']))
+        NumSamples = np.concatenate([old['NumSamples'],NumSamples])
+        TauTwo = np.concatenate([old['TauTwo'],TauTwo])
+    NumSamples = np.unique(NumSamples)
+    TauTwo = np.unique(TauTwo)
+    GrandMatrix = np.full([len(NumSamples),len(TauTwo),4,4],np.nan)
+    if os.path.exists(os.path.join(path,'manifest.json')):
+        rows = np.searchsorted(NumSamples,old['NumSamples'])
+        columns = np.searchsorted(TauTwo,old['TauTwo'])
+        GrandMatrix[np.ix_(rows,columns)] = old['GrandMatrix']
+
+#   compute the missing points
+    jobs = [ (i,j,NumSamples[i],TauTwo[j],trials,seed)
+             for i in range(len(NumSamples)) for j in range(len(TauTwo))
+             if np.isnan(GrandMatrix[i,j,0,0]) ]
+    if verbose == True:
+        print("computing",len(jobs),"of",GrandMatrix.shape[0]*GrandMatrix.shape[1],"table points")
+
+    def collect(finished):
+        done = 0
+        for i, j, covariance in finished:
+            GrandMatrix[i,j] = covariance
+            done = done + 1
+            if done % checkpoint == 0:
+                write(path,NumSamples,TauTwo,GrandMatrix,trials,seed)
+                if verbose == True:
+                    print("   ...",done,"points")
+
+    if workers == 1 or len(jobs) == 0:
+        collect(map(covpoint,jobs))
+    else:
+        with multiprocessing.Pool(workers) as pool:	# closed even if a worker fails
+            collect(pool.imap_unordered(covpoint,jobs))
+
+    write(path,NumSamples,TauTwo,GrandMatrix,trials,seed)
+
+    return cu.readtable(path)